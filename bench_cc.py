@@ -0,0 +1,255 @@
+#!/usr/bin/env python3.6
+#
+# Copyright 2016-2018 Trustees of Indiana University
+#
+# This code is licensed under the APACHE 2.0 License
+#
+
+"""
+Render synthetic line 21 waveforms and benchmark the decoders with them.
+
+The waveforms follow FCC 73.699 figure 17:  7 cycles of 0.503MHz run-in,
+two low bits of dead space, a start bit and 16 data bits at 0.503Mbps,
+as two 7-bit + odd parity characters.
+"""
+
+from decode_cc import decodeFrame, decodeLine, decodeLines, decodeRows, getByteStream, EXECUTORS
+import numpy as np
+import tempfile
+import argparse
+import time
+import sys
+import os
+
+# One bit (and one cycle of the run-in) in microseconds
+BIT_US = 1.986
+
+# The visible part of the line that a 720 pixel wide frame covers at
+# 13.5MHz, in microseconds
+LINE_US = 720 / 13.5
+
+
+def parity(byte):
+    """
+    Add the odd parity bit to a 7-bit value
+    """
+    byte = byte & 0x7F
+    return byte if bin(byte).count("1") & 1 else byte | 0x80
+
+
+def renderLine(first, second, width = 704, offset = None, amplitude = 110,
+               black = 16, noise = 0, blur = 0, rng = None):
+    """
+    Render one line 21 waveform
+
+    Parameters
+    ----------
+    first, second : The two 7-bit characters to encode
+    width : The width of the line in pixels
+    offset : Where the run-in starts, in pixels (defaults to 1.5% of the
+             width)
+    amplitude : The luma of a 1 bit above black
+    black : The luma of a 0 bit
+    noise : The standard deviation of gaussian noise added to the luma
+    blur : The standard deviation (in pixels) of a gaussian blur
+    rng : A numpy random Generator for the noise
+
+    Returns
+    -------
+    A 1D uint8 array of luma values
+    """
+    scale = width / LINE_US
+    if offset is None:
+        offset = width * 0.015
+    t = (np.arange(width) - offset) / scale
+
+    # The run-in starts at the bottom of a cycle, and the data starts two
+    # bits after the middle of its last fall.
+    signal = np.zeros(width)
+    runIn = (t >= 0) & (t < 7 * BIT_US)
+    signal[runIn] = 0.5 - 0.5 * np.cos(2 * np.pi * t[runIn] / BIT_US)
+    bits = [1] + [(parity(c) >> b) & 1 for c in (first, second) for b in range(8)]
+    dataStart = 6.75 * BIT_US + 2 * BIT_US
+    bit = np.floor((t - dataStart) / BIT_US).astype(int)
+    inData = (bit >= 0) & (bit < len(bits))
+    signal[inData] = np.array(bits)[bit[inData]]
+
+    if blur > 0:
+        x = np.arange(-int(3 * blur) - 1, int(3 * blur) + 2)
+        kernel = np.exp(-0.5 * (x / blur) ** 2)
+        signal = np.convolve(signal, kernel / kernel.sum(), mode = "same")
+    luma = black + amplitude * signal
+    if noise > 0:
+        rng = rng if rng is not None else np.random.default_rng()
+        luma = luma + rng.normal(0, noise, width)
+    return np.clip(np.round(luma), 0, 255).astype(np.uint8)
+
+
+def renderLines(pairs, width = 704, offset = None, jitter = 0, rng = None, **options):
+    """
+    Render a line for each (first, second) pair, as a (frames x width)
+    uint8 array.  Pairs of None render as a black line.  jitter is the
+    standard deviation (in pixels) of a random shift of each line; the
+    rest of the options are passed to renderLine.
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    if offset is None:
+        offset = width * 0.015
+    lines = np.zeros((len(pairs), width), dtype = np.uint8)
+    for i, pair in enumerate(pairs):
+        shift = offset + (rng.normal(0, jitter) if jitter > 0 else 0)
+        if pair is None:
+            lines[i] = renderLine(0, 0, width, shift, rng = rng,
+                                  **dict(options, amplitude = 0))
+        else:
+            lines[i] = renderLine(pair[0], pair[1], width, shift, rng = rng, **options)
+    return lines
+
+
+def randomPairs(count, empty = 0.1, rng = None):
+    """
+    Make count random pairs of printable characters, with about empty of
+    them None.
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    chars = rng.integers(0x20, 0x7F, (count, 2))
+    return [None if rng.random() < empty else (int(a), int(b)) for a, b in chars]
+
+
+def accuracy(pairs, decoded):
+    """
+    The fraction of frames which decoded to the right bytes (nulls for
+    the empty ones).
+    """
+    expected = np.array([p if p is not None else (0, 0) for p in pairs], dtype = np.uint8)
+    decoded = np.asarray(decoded, dtype = np.uint8).reshape(-1, 2)
+    return float((decoded == expected).all(axis = 1).mean())
+
+
+def writeFrames(lines, directory, line = 1, height = 4):
+    """
+    Write each line as a PGM frame (like extract_cc_bytestream makes) with
+    the CC data on the given line.  Returns the filenames.
+    """
+    files = []
+    for i, values in enumerate(lines):
+        frame = np.zeros((height, len(values)), dtype = np.uint8)
+        frame[line] = values
+        name = os.path.join(directory, f"frame{i + 1:06d}.pgm")
+        with open(name, "wb") as f:
+            f.write(f"P5\n{len(values)} {height}\n255\n".encode("ascii"))
+            f.write(frame.tobytes())
+        files.append(name)
+    return files
+
+
+def bench(name, function, frames):
+    """
+    Run function once and return a result row:  name, frames per second
+    and whatever the function returned.
+    """
+    start = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - start
+    return name, frames / elapsed if elapsed else float("inf"), result
+
+
+def quiet(function):
+    """
+    Run function with stderr thrown away (decodeFrame reports every
+    rejected frame with DEBUG)
+    """
+    def run():
+        with open(os.devnull, "w") as null:
+            saved, sys.stderr = sys.stderr, null
+            try:
+                return function()
+            finally:
+                sys.stderr = saved
+    return run
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Benchmark the CC decoders on synthetic frames")
+    parser.add_argument("--frames",
+                        default = 5000,
+                        type = int,
+                        help = "Number of frames (default 5000)")
+    parser.add_argument("--width",
+                        default = [704],
+                        type = int,
+                        nargs = "+",
+                        help = "Line widths to test (default 704)")
+    parser.add_argument("--threads",
+                        default = [1, 2, 4],
+                        type = int,
+                        nargs = "+",
+                        help = "Thread counts for getByteStream (default 1 2 4)")
+    parser.add_argument("--executor",
+                        default = ["process", "thread"],
+                        choices = EXECUTORS,
+                        nargs = "+",
+                        help = "Executors for getByteStream (default process thread)")
+    parser.add_argument("--amplitude",
+                        default = 110,
+                        type = float,
+                        help = "Luma of a 1 bit above black (default 110)")
+    parser.add_argument("--noise",
+                        default = 4,
+                        type = float,
+                        help = "Standard deviation of the luma noise (default 4)")
+    parser.add_argument("--blur",
+                        default = 1,
+                        type = float,
+                        help = "Standard deviation of the blur in pixels (default 1)")
+    parser.add_argument("--jitter",
+                        default = 1,
+                        type = float,
+                        help = "Standard deviation of the line position in pixels (default 1)")
+    parser.add_argument("--empty",
+                        default = 0.1,
+                        type = float,
+                        help = "Fraction of frames without CC (default 0.1)")
+    parser.add_argument("--seed",
+                        default = 21,
+                        type = int,
+                        help = "Random seed (default 21)")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    print(f"{'decoder':<36} {'width':>6} {'frames/s':>12} {'accuracy':>9}")
+    for width in args.width:
+        pairs = randomPairs(args.frames, args.empty, rng)
+        lines = renderLines(pairs, width, jitter = args.jitter, rng = rng,
+                            amplitude = args.amplitude, noise = args.noise,
+                            blur = args.blur)
+        results = [
+            bench("decodeLines", lambda: decodeLines(lines)[0], len(lines)),
+            bench("decodeLines subpixel", lambda: decodeLines(lines, subpixel = True)[0],
+                  len(lines)),
+            bench("decodeRows tiered", lambda: decodeRows(lines[:, None])[0], len(lines)),
+            bench("decodeLine", quiet(lambda: [_safe(decodeLine, l) for l in lines]), len(lines)),
+        ]
+        with tempfile.TemporaryDirectory() as directory:
+            files = writeFrames(lines, directory)
+            results.append(bench("decodeFrame", quiet(lambda: [decodeFrame(f, 1, 0) for f in files]),
+                                 len(files)))
+            for executor in args.executor:
+                for threads in args.threads:
+                    results.append(bench(f"getByteStream {executor} threads={threads}",
+                                         quiet(lambda: getByteStream(files, 1, threads,
+                                                                     executor = executor)),
+                                         len(files)))
+        for name, rate, decoded in results:
+            print(f"{name:<36} {width:>6} {rate:>12.0f} {accuracy(pairs, decoded):>9.4f}")
+
+
+def _safe(decoder, values):
+    try:
+        return decoder(values)
+    except ValueError:
+        return (0, 0)
+
+
+if __name__ == "__main__":
+    main()
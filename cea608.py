@@ -0,0 +1,302 @@
+#
+# Copyright 2016-2018 Trustees of Indiana University
+#
+# This code is licensed under the APACHE 2.0 License
+#
+
+"""
+Decode a CEA-608 (line 21) byte pair stream into captions and write them
+as WebVTT or SRT.
+
+This takes the place of running the raw bytestream through ccextractor.
+It handles the caption modes (pop-on, roll-up and paint-on), the control
+codes that go with them, and the special and extended character sets.
+Text mode and XDS data are skipped, and styles and positions are dropped
+since WebVTT and SRT are just the text.
+"""
+
+ROWS = 15
+COLUMNS = 32
+
+# The basic character set is ASCII, except for these
+_BASIC = {0x2A: "á", 0x5C: "é", 0x5E: "í", 0x5F: "ó", 0x60: "ú",
+          0x7B: "ç", 0x7C: "÷", 0x7D: "Ñ", 0x7E: "ñ", 0x7F: "█"}
+
+# Special characters:  0x11 (or 0x19) followed by 0x30 - 0x3F
+_SPECIAL = "®°½¿™¢£♪à èâêîôû"
+
+# Extended characters:  0x12 (or 0x1A) and 0x13 (or 0x1B) followed by
+# 0x20 - 0x3F.  These replace the character before them.
+_EXTENDED = {0x12: "ÁÉÓÚÜü‘¡*’—©℠•“”ÀÂÇÈÊËëÎÏïÔÙùÛ«»",
+             0x13: "ÃãÍÌìÒòÕõ{}\\^_|~ÄäÖöß¥¤│ÅåØø┌┐└┘"}
+
+# The rows for the preamble address codes, by the first byte (without
+# the channel bit) and whether the second byte is 0x40 - 0x5F or
+# 0x60 - 0x7F.
+_PAC_ROWS = {0x11: (1, 2), 0x12: (3, 4), 0x15: (5, 6), 0x16: (7, 8),
+             0x17: (9, 10), 0x10: (11, None), 0x13: (12, 13), 0x14: (14, 15)}
+
+POP_ON = "pop-on"
+ROLL_UP = "roll-up"
+PAINT_ON = "paint-on"
+TEXT = "text"
+
+
+class CaptionDecoder:
+    """
+    Turn a stream of CEA-608 byte pairs (one per frame) into captions.
+
+    Parameters
+    ----------
+    channel : The caption channel to decode:  1 or 2 for CC1 or CC2 on
+              field 1, 3 or 4 for CC3 or CC4 on field 2.
+
+    Notes
+    -----
+    Feed the bytes in order with feed() and finish with finish().  Both
+    return the captions that are done as (start frame, end frame, text)
+    tuples, so captions can be written out as the stream is decoded.
+
+    A caption starts whenever the text on the screen changes:  when a
+    pop-on caption is swapped in, when a roll-up caption scrolls, when the
+    screen is erased, or when text written straight to the screen (roll-up
+    or paint-on) is followed by a control code.
+    """
+
+    def __init__(self, channel = 1):
+        if channel not in (1, 2, 3, 4):
+            raise ValueError(f"Caption channel must be 1 - 4, not {channel}")
+        self.channel = (channel - 1) & 1
+        self.active = 0
+        self.mode = POP_ON
+        self.displayed = _blankMemory()
+        self.hidden = _blankMemory()
+        self.row = ROWS
+        self.column = 0
+        self.rollRows = 2
+        self.lastControl = None
+        self.xds = False
+        self.dirty = None
+        self.caption = ""
+        self.captionStart = 0
+        self.frame = 0
+
+    def feed(self, data, frame = None):
+        """
+        Decode the byte pairs in data (two bytes per frame, with the
+        parity bits stripped).  frame is the frame number of the first
+        pair; it defaults to following on from the last call.  Returns
+        a list of the captions which have ended.
+        """
+        if frame is not None:
+            self.frame = frame
+        cues = []
+        for i in range(0, len(data) - 1, 2):
+            self._pair(data[i] & 0x7F, data[i + 1] & 0x7F, cues)
+            self.frame += 1
+        return cues
+
+    def finish(self, frame = None):
+        """
+        End the stream at frame (defaulting to the frame after the last
+        pair) and return the captions which are left.
+        """
+        if frame is not None:
+            self.frame = frame
+        cues = []
+        self._flush(cues)
+        self._show(cues, "")
+        return cues
+
+    def _pair(self, first, second, cues):
+        if first == 0 and second == 0:
+            self.lastControl = None
+            return
+        if 0x10 <= first <= 0x1F:
+            pair = (first, second)
+            if pair == self.lastControl:
+                # control codes are sent twice, but only act once
+                self.lastControl = None
+                return
+            self.lastControl = pair
+            self.xds = False
+            self.active = (first >> 3) & 1
+            if self.active == self.channel:
+                self._flush(cues)
+                self._control(first & 0x17, second, cues)
+            return
+        self.lastControl = None
+        if 0x01 <= first <= 0x0F:
+            # XDS runs until the end (0x0F) code
+            self.xds = first != 0x0F
+            return
+        if self.xds or self.active != self.channel or self.mode == TEXT:
+            return
+        for c in (first, second):
+            if c >= 0x20:
+                self._write(_BASIC.get(c, chr(c)))
+
+    def _control(self, first, second, cues):
+        if first in _PAC_ROWS and 0x40 <= second <= 0x7F:
+            row = _PAC_ROWS[first][(second >> 5) & 1]
+            if row is not None:
+                self._address(row, ((second & 0x1F) >> 1) - 8)
+        elif first == 0x11 and 0x20 <= second <= 0x2F:
+            # mid-row style codes take up a space
+            self._write(" ")
+        elif first == 0x11 and 0x30 <= second <= 0x3F:
+            self._write(_SPECIAL[second - 0x30])
+        elif first in (0x12, 0x13) and 0x20 <= second <= 0x3F:
+            self._backspace()
+            self._write(_EXTENDED[first][second - 0x20])
+        elif first == 0x17 and 0x21 <= second <= 0x23:
+            self.column = min(self.column + second - 0x20, COLUMNS - 1)
+        elif first in (0x14, 0x15) and 0x20 <= second <= 0x2F:
+            self._command(second, cues)
+
+    def _command(self, command, cues):
+        if command == 0x20:    # RCL: resume caption loading
+            self.mode = POP_ON
+        elif command == 0x21:  # BS: backspace
+            self._backspace()
+        elif command == 0x24:  # DER: delete to end of row
+            self._memory()[self.row - 1][self.column:] = [" "] * (COLUMNS - self.column)
+            self._touch()
+        elif command in (0x25, 0x26, 0x27):  # RU2, RU3, RU4
+            if self.mode != ROLL_UP:
+                self.displayed = _blankMemory()
+                self.hidden = _blankMemory()
+                self.row = ROWS
+                self._show(cues, "")
+            self.mode = ROLL_UP
+            self.rollRows = command - 0x23
+            self.column = 0
+        elif command == 0x29:  # RDC: resume direct captioning
+            self.mode = PAINT_ON
+        elif command in (0x2A, 0x2B):  # TR, RTD: text mode
+            self.mode = TEXT
+        elif command == 0x2C:  # EDM: erase displayed memory
+            self.displayed = _blankMemory()
+            self._show(cues)
+        elif command == 0x2D:  # CR: carriage return
+            if self.mode == ROLL_UP:
+                top = max(self.row - self.rollRows, 0)
+                del self.displayed[top]
+                self.displayed.insert(self.row - 1, [" "] * COLUMNS)
+                self._show(cues)
+            self.column = 0
+        elif command == 0x2E:  # ENM: erase non-displayed memory
+            self.hidden = _blankMemory()
+        elif command == 0x2F:  # EOC: end of caption
+            self.displayed, self.hidden = self.hidden, self.displayed
+            self.mode = POP_ON
+            self._show(cues)
+
+    def _address(self, row, indent):
+        if self.mode == ROLL_UP and row != self.row:
+            # move the roll-up window to the new base row
+            window = self.displayed[max(self.row - self.rollRows, 0):self.row]
+            self.displayed = _blankMemory()
+            self.displayed[max(row - len(window), 0):row] = window[-row:]
+            self._touch()
+        self.row = row
+        self.column = max(indent, 0) * 4
+
+    def _memory(self):
+        return self.hidden if self.mode == POP_ON else self.displayed
+
+    def _write(self, character):
+        self._memory()[self.row - 1][self.column] = character
+        self.column = min(self.column + 1, COLUMNS - 1)
+        self._touch()
+
+    def _backspace(self):
+        if self.column > 0:
+            self.column -= 1
+            self._memory()[self.row - 1][self.column] = " "
+            self._touch()
+
+    def _touch(self):
+        """
+        Note that the displayed memory was changed, if it was.
+        """
+        if self.mode != POP_ON and self.dirty is None:
+            self.dirty = self.frame
+
+    def _flush(self, cues):
+        """
+        Show the changes written straight to the screen, as of when they
+        started.
+        """
+        if self.dirty is not None:
+            frame, self.frame = self.frame, self.dirty
+            self._show(cues)
+            self.frame = frame
+            self.dirty = None
+
+    def _show(self, cues, text = None):
+        """
+        End the current caption and start one with what's on the screen
+        now (or text), unless the text didn't change.
+        """
+        if text is None:
+            text = "\n".join(r for r in ("".join(row).strip() for row in self.displayed) if r)
+        if text == self.caption:
+            return
+        if self.caption and self.frame > self.captionStart:
+            cues.append((self.captionStart, self.frame, self.caption))
+        self.caption = text
+        self.captionStart = self.frame
+
+
+def _blankMemory():
+    return [[" "] * COLUMNS for row in range(ROWS)]
+
+
+def timestamp(seconds, separator = "."):
+    """
+    Format seconds as HH:MM:SS.mmm (or with a different separator before
+    the milliseconds, for SRT)
+    """
+    ms = int(round(seconds * 1000))
+    return f"{ms // 3600000:02d}:{ms // 60000 % 60:02d}:{ms // 1000 % 60:02d}{separator}{ms % 1000:03d}"
+
+
+class SubtitleWriter:
+    """
+    Write captions from a CaptionDecoder to a WebVTT or SRT file as they
+    arrive.
+
+    Parameters
+    ----------
+    output : The text file to write to
+    format : "vtt" or "srt"
+    framerate : Frames per second, to turn frame numbers into times
+    """
+
+    def __init__(self, output, format = "vtt", framerate = 29.97):
+        if format not in ("vtt", "srt"):
+            raise ValueError(f"Unknown subtitle format: {format}")
+        self.output = output
+        self.format = format
+        self.framerate = framerate
+        self.count = 0
+        if format == "vtt":
+            print("WEBVTT\n", file = output)
+
+    def write(self, cues):
+        """
+        Write a list of (start frame, end frame, text) captions
+        """
+        for start, end, text in cues:
+            self.count += 1
+            start = start / self.framerate
+            end = end / self.framerate
+            if self.format == "vtt":
+                print(f"{timestamp(start)} --> {timestamp(end)}\n{text}\n",
+                      file = self.output)
+            else:
+                print(f"{self.count}\n{timestamp(start, ',')} --> {timestamp(end, ',')}\n{text}\n",
+                      file = self.output)
+        if cues:
+            self.output.flush()
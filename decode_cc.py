@@ -6,27 +6,317 @@
 #
 
 from PIL import Image
+import numpy as np
 from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+from functools import partial, lru_cache
+from itertools import chain
+from collections import deque
 import sys
 import math
 import argparse
 import os
+import re
+import fnmatch
+import mmap
+import subprocess
+import tarfile
+import zipfile
+import struct
+import io
+import time
+import json
+import base64
+import sqlite3
+from cea608 import CaptionDecoder, SubtitleWriter
 
+# The ffmpeg crop used when reading video directly.  These match the crop
+# in extract_cc_bytestream.
+CROP_WIDTH = 704
+CROP_X = 8
 
-def decodeFrame(filename, line, DEBUG):
+# Status codes for decodeLines.  Everything other than STATUS_OK decodes
+# as a pair of nulls.
+STATUS_OK = 0          # decoded and passed the parity check
+STATUS_BLACK = 1       # the line is too dark to carry data
+STATUS_LATE_RUNIN = 2  # the run-in starts too far into the line
+STATUS_NO_RUNIN = 3    # there aren't enough transitions for a run-in
+STATUS_RUNIN_SIZE = 4  # the run-in is too short or too long
+STATUS_SANITY = 5      # the dead bits and start bit aren't 0, 0, 1
+STATUS_RANGE = 6       # a data bit falls outside of the line
+STATUS_PARITY = 7      # a byte failed the parity check
+
+STATUS_NAMES = ("ok", "black line", "late run-in", "no run-in",
+                "run-in size", "sanity", "out of range", "parity")
+
+# The codes that mean there's no CC on the line at all, rather than CC
+# that didn't decode
+STATUS_EMPTY = (STATUS_BLACK, STATUS_LATE_RUNIN, STATUS_NO_RUNIN)
+
+# Not a decodeLines code:  the status in the details (see DETAIL_DTYPE)
+# of a frame that iterAdaptiveByteStream skipped
+STATUS_SKIPPED = 255
+
+# The record for each line in the streams with details:  the two bytes
+# and status (the same as the streams with status), then what
+# decodeLines measured (see detailRecords).  The --sidecar file adds the
+# frame and which of the lines it is.
+DETAIL_DTYPE = np.dtype([("first", "u1"), ("second", "u1"), ("status", "u1"),
+                         ("maxluma", "u1"), ("startRunIn", "<u2"), ("bitWidth", "<f4"),
+                         ("margin", "u1")])
+SIDECAR_DTYPE = np.dtype([("frame", "<u4"), ("line", "u1")] + DETAIL_DTYPE.descr)
+
+# How decodeRows got each frame:  from the CC line itself, from the
+# average of the rows, by voting on the bits of all of the rows, from one
+# of the other rows on its own, not at all, from the CC line with
+# subpixel timing, or from the line (or average) with adaptive
+# thresholds.
+STRATEGY_LINE = 0
+STRATEGY_AVERAGE = 1
+STRATEGY_VOTE = 2
+STRATEGY_ROW = 3
+STRATEGY_NONE = 4
+STRATEGY_SUBPIXEL = 5
+STRATEGY_ADAPTIVE = 6
+
+STRATEGY_NAMES = ("line", "average", "vote", "row", "none", "subpixel", "adaptive")
+
+# Goes into the ResultCache keys.  Change it whenever a change to the
+# decoders could change what they decode, so old results aren't used.
+DECODER_VERSION = "3"
+
+
+# The thresholded value of every luma value for every possible maxluma:
+# 0 or 1 for below or above 50%, and -1 for the hysteresis band in the
+# middle 10%.  It uses the same floating point math as decodeLine, so a
+# lookup gives identical results.
+with np.errstate(divide = "ignore", invalid = "ignore"):
+    _percent = np.floor(100 * (np.arange(256)[None, :] / np.arange(256)[:, None]))
+_LEVELS = np.where((_percent >= 45) & (_percent <= 55), -1, _percent > 50).astype(np.int8)
+del _percent
+
+
+class Stats:
+    """
+    Per-stage latency histograms and outcome counters for the decoders.
+
+    Stage times go into log2 histograms (in microseconds) along with the
+    number of calls, the number of frames they covered and the total
+    time.  Outcomes are counted by STATUS_* code, and with decodeRows,
+    the strategies by STRATEGY_* code.  Frames that iterAdaptiveByteStream
+    didn't decode are counted as skipped, and the lines it had decoded
+    ahead and then threw away as discarded.  Stats from different
+    processes (or frames) can be merged, and the whole thing can be
+    reported as JSON.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.outcomes = {}
+        self.strategies = {}
+        self.stages = {}
+        self.skipped = 0
+        self.discarded = 0
+
+    def clock(self):
+        return time.perf_counter()
+
+    def time(self, stage, seconds, frames = 1):
+        """
+        Record seconds spent in stage for the given number of frames
+        """
+        bucket = max(0, int(math.log2(seconds * 1e6))) if seconds > 0 else 0
+        calls, count, total, histogram = self.stages.get(stage, (0, 0, 0.0, {}))
+        histogram[bucket] = histogram.get(bucket, 0) + 1
+        self.stages[stage] = (calls + 1, count + frames, total + seconds, histogram)
+
+    def lap(self, stage, clock, status = None, frames = 1):
+        """
+        Record the time since clock for stage (and status, if given), and
+        return the new clock.
+        """
+        now = time.perf_counter()
+        self.time(stage, now - clock, frames)
+        if status is not None:
+            self.count(status)
+        return now
+
+    def count(self, status, n = 1):
+        self.outcomes[status] = self.outcomes.get(status, 0) + n
+
+    def counts(self, status):
+        """
+        Count an array of STATUS_* codes
+        """
+        for code, n in enumerate(np.bincount(status, minlength = len(STATUS_NAMES))):
+            if n:
+                self.count(code, int(n))
+
+    def countStrategies(self, strategy):
+        """
+        Count an array of STRATEGY_* codes
+        """
+        for code, n in enumerate(np.bincount(strategy, minlength = len(STRATEGY_NAMES))):
+            if n:
+                self.strategies[code] = self.strategies.get(code, 0) + int(n)
+
+    def merge(self, other):
+        for status, n in other.outcomes.items():
+            self.count(status, n)
+        for code, n in other.strategies.items():
+            self.strategies[code] = self.strategies.get(code, 0) + n
+        self.skipped += other.skipped
+        self.discarded += other.discarded
+        for stage, (calls, count, total, histogram) in other.stages.items():
+            mine = self.stages.get(stage, (0, 0, 0.0, {}))
+            merged = dict(mine[3])
+            for bucket, n in histogram.items():
+                merged[bucket] = merged.get(bucket, 0) + n
+            self.stages[stage] = (mine[0] + calls, mine[1] + count, mine[2] + total, merged)
+
+    def report(self):
+        """
+        The stats as a dict, ready for JSON
+        """
+        stages = {}
+        for stage, (calls, count, total, histogram) in self.stages.items():
+            stages[stage] = {
+                "calls": calls,
+                "frames": count,
+                "seconds": total,
+                "us_per_frame": total * 1e6 / count if count else 0,
+                "histogram_us": {f"<{2 ** (b + 1)}": histogram[b] for b in sorted(histogram)},
+            }
+        report = {
+            "elapsed": time.time() - self.started,
+            "frames": sum(self.outcomes.values()),
+            "outcomes": {name: self.outcomes.get(code, 0) for code, name in enumerate(STATUS_NAMES)},
+            "stages": stages,
+        }
+        if self.skipped:
+            report["skipped"] = self.skipped
+        if self.discarded:
+            report["discarded"] = self.discarded
+        if self.strategies:
+            report["strategies"] = {name: self.strategies.get(code, 0)
+                                    for code, name in enumerate(STRATEGY_NAMES)}
+        return report
+
+    def dump(self, filename):
+        """
+        Write the report to filename as JSON, replacing it in one go so a
+        reader never sees half of it.
+        """
+        with open(filename + ".tmp", "w") as f:
+            json.dump(self.report(), f, indent = 2)
+        os.replace(filename + ".tmp", filename)
+
+
+class ResultCache:
+    """
+    An on-disk (SQLite) cache of the bytes and status decoded from frame
+    files, so frames that haven't changed aren't decoded again.
+
+    Parameters
+    ----------
+    filename : The cache database
+    limit : The most frames to keep.  Past that, the ones that were used
+            least recently are dropped.
+
+    Notes
+    -----
+    Frames are keyed by their absolute path, the line, and the decoder
+    (DECODER_VERSION and whether the geometry was locked), and an entry
+    only counts if the file's size and modification time still match.
+    Use is tracked per lookup or store rather than per frame, which is
+    plenty for LRU over runs of whole directories.
+    """
+
+    def __init__(self, filename, limit = 1000000):
+        self.limit = limit
+        self.db = sqlite3.connect(filename)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS frames (
+                               path TEXT, line INTEGER, decoder TEXT,
+                               size INTEGER, mtime INTEGER,
+                               pair BLOB, status INTEGER, used INTEGER,
+                               PRIMARY KEY (path, line, decoder))""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS frames_used ON frames (used)")
+        self.used = self.db.execute("SELECT MAX(used) FROM frames").fetchone()[0] or 0
+
+    @staticmethod
+    def key(filename):
+        """
+        The (path, size, mtime) that identifies a frame file
+        """
+        info = os.stat(filename)
+        return os.path.abspath(filename), info.st_size, info.st_mtime_ns
+
+    def lookup(self, keys, line, decoder):
+        """
+        Look up a list of keys (from key()).  Returns a list with the two
+        bytes plus the status (as 3 bytes) for each key, or None if it
+        isn't cached.
+        """
+        self.used += 1
+        found = {}
+        for start in range(0, len(keys), 500):
+            paths = [k[0] for k in keys[start:start + 500]]
+            where = f"line = ? AND decoder = ? AND path IN ({','.join('?' * len(paths))})"
+            for path, size, mtime, pair, status in self.db.execute(
+                    f"SELECT path, size, mtime, pair, status FROM frames WHERE {where}",
+                    [line, decoder] + paths):
+                found[path] = (size, mtime, bytes(pair) + bytes((status,)))
+            self.db.execute(f"UPDATE frames SET used = ? WHERE {where}",
+                            [self.used, line, decoder] + paths)
+        self.db.commit()
+        records = []
+        for path, size, mtime in keys:
+            entry = found.get(path)
+            records.append(entry[2] if entry and entry[:2] == (size, mtime) else None)
+        return records
+
+    def store(self, entries, line, decoder):
+        """
+        Cache a list of (key, 3 byte record) entries, and drop the least
+        recently used frames if there are too many.
+        """
+        self.used += 1
+        self.db.executemany("INSERT OR REPLACE INTO frames VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                            [(path, line, decoder, size, mtime, record[:2], record[2], self.used)
+                             for (path, size, mtime), record in entries])
+        extra = self.db.execute("SELECT COUNT(*) FROM frames").fetchone()[0] - self.limit
+        if extra > 0:
+            self.db.execute("DELETE FROM frames WHERE rowid IN "
+                            "(SELECT rowid FROM frames ORDER BY used LIMIT ?)", (extra,))
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+
+def decodeFrame(filename, line, DEBUG, stats = None, vote = 1, subpixel = False,
+                tiered = False):
     """
     Take a frame image and extract the line 21 CC bytes
 
     Parameters
     ----------
     filename : The frame image filename
-    line : The line (in the image) where the CC data appears
+    line : The line (in the image) where the CC data appears, or a list
+           of lines (like the line 21 of each field) to decode from one
+           read of the image
     DEBUG : turn on debugging
+    stats : A Stats to record the stage times and outcome in
+    vote : Read this many rows around the line and fall back on them when
+           the line itself doesn't decode (see decodeRows)
+    subpixel : Time the bits to a fraction of a pixel (see decodeLines)
+    tiered : Try harder on the lines that don't decode (see decodeRows)
 
     Returns
     -------
     Two bytes of decoded data, or a pair of nulls if the frame doesn't
-    contain valid CC.
+    contain valid CC.  With a list of lines, two bytes for each line.
+    Use decodeFrameStatus to find out why a line didn't decode.
 
     Notes
     -----
@@ -83,228 +373,2759 @@ def decodeFrame(filename, line, DEBUG):
     After that, it's just a matter of reading the bits.
     
     """
-    original = Image.open(filename)
+    if vote > 1 or subpixel or tiered:
+        pairs = decodeFrameStatus(filename, line, DEBUG, stats, vote = vote, subpixel = subpixel,
+                                  tiered = tiered)[0]
+        return tuple(pairs.ravel().tolist())
+    clock = stats.clock() if stats else None
+    if isinstance(line, (tuple, list)):
+        rows = readLines(filename, line)
+        if stats: stats.lap("read", clock, frames = len(line))
+        return tuple(b for l, values in zip(line, rows)
+                     for b in _decodeFrameLine(filename, l, values, DEBUG, stats))
+    values = readLine(filename, line)
+    if stats: stats.lap("read", clock)
+    return _decodeFrameLine(filename, line, values, DEBUG, stats)
+
+
+def _decodeFrameLine(filename, line, values, DEBUG, stats):
+    """
+    The decodeLine part of decodeFrame.  Lines that fail are nulls, and
+    only say why with DEBUG.
+    """
+    if not DEBUG:
+        return decodeLineStatus(values, DEBUG, filename, stats)[0]
+    print(f"File: {filename}, Line: {line}, Dimensions: {len(values)}x1",
+          file = sys.stderr)
+
+    try:
+        return decodeLine(values, DEBUG, filename, stats)
+    except ValueError as e:
+        print(f"Value Exception: {e}", file = sys.stderr)
+        return (0, 0)
+
+
+def readLine(filename, line):
+    """
+    Read one line of luma values from a frame image
+
+    Parameters
+    ----------
+    filename : The frame image filename (or the contents of the file, as
+               bytes)
+    line : The line in the image
+
+    Returns
+    -------
+    A 1D uint8 array of the luma values.  Lines outside of the image are
+    black.
+
+    Notes
+    -----
+    8-bit P5 PGM files (which is what extract_cc_bytestream and most
+    ffmpeg command lines produce) are memory-mapped and only the one line
+    is touched.  Everything else goes through PIL.
+    """
+    if isinstance(filename, bytes):
+        values = parsePGMLine(filename, line)
+    else:
+        values = readPGMLine(filename, line)
+    if values is not None:
+        return values
+    original = _openImage(filename)
     luma = original.convert(mode = "L")
     width, heigh = luma.size
     line21 = luma.crop((0, line, width, line + 1))
-    pixels = line21.load()
+    return np.asarray(line21)[0]
 
-    if DEBUG:
-        print(f"File: {filename}, Line: {line}, Dimensions: {line21.width}x{line21.height}",
-              file = sys.stderr)
-              
-    
-    # find the maximum value and convert the image to a list of values
-    values = []
-    maxluma = 0
-    for x in range(width):
-        cpixel = pixels[x, 0]
-        if cpixel > maxluma: maxluma = cpixel
-        values.append(cpixel)
+
+# P5 header:  the magic, width, height and maxval separated by whitespace
+# (with optional comments) and a single whitespace character before the
+# pixel data.
+_PGM_HEADER = re.compile(rb"P5(?:\s+(?:#[^\n]*\n\s*)*(\d+)){3}\s")
+_PGM_FIELDS = re.compile(rb"(?:#[^\n]*\n)|(\d+)")
+
+
+def readLines(filename, lines):
+    """
+    Read several lines of luma values from a frame image (a filename or
+    the contents of the file, as bytes), opening and converting it only
+    once.  Returns a (lines x width) uint8 array.  Lines outside of the
+    image are black.
+    """
+    buffer = filename if isinstance(filename, bytes) else _mapPGM(filename)
+    if buffer is not None:
+        rows = [parsePGMLine(buffer, line) for line in lines]
+        if all(row is not None for row in rows):
+            return np.stack(rows)
+    luma = _openImage(filename).convert(mode = "L")
+    width, height = luma.size
+    return np.stack([np.asarray(luma.crop((0, line, width, line + 1)))[0] for line in lines])
+
+
+def _readRows(filename, line, vote = 1):
+    """
+    readLines for a list of lines, or readLine for one line, as a 2D array.
+    With vote > 1, the voteRows around the line as a 3D (1 x vote x width)
+    array for decodeRows, leaving out the rows that aren't in the image
+    (a line that isn't in it at all is read as one black row).
+    """
+    if isinstance(line, (tuple, list)):
+        return readLines(filename, line)
+    if vote > 1:
+        height = _imageHeight(filename)
+        rows = [r for r in voteRows(line, height) if 0 <= r < height][:vote]
+        return readLines(filename, rows or [line])[None]
+    return readLine(filename, line)[None, :]
+
+
+def _imageHeight(filename):
+    """
+    The height of a frame image (a filename or the contents of the file,
+    as bytes), from the header of an 8-bit P5 PGM file or else from PIL.
+    """
+    buffer = filename if isinstance(filename, bytes) else _mapPGM(filename)
+    header = None if buffer is None else _parsePGMHeader(buffer)
+    if header is not None:
+        return header[1]
+    return _openImage(filename).size[1]
+
+
+def readPGMLine(filename, line):
+    """
+    Return a view of one line of an 8-bit P5 PGM file, or None if the
+    file isn't one (or the line isn't in it).  The file is memory-mapped
+    rather than read.
+    """
+    buffer = _mapPGM(filename)
+    return None if buffer is None else parsePGMLine(buffer, line)
+
+
+def parsePGMLine(buffer, line):
+    """
+    Return a view of one line of an 8-bit P5 PGM image held in a buffer
+    (bytes, mmap, etc), or None if it isn't one or the line isn't in it.
+    """
+    header = _parsePGMHeader(buffer)
+    if header is None:
+        return None
+    width, height, offset = header
+    offset = offset + line * width
+    if not 0 <= line < height or offset + width > len(buffer):
+        return None
+    return np.frombuffer(buffer, dtype = np.uint8, count = width, offset = offset)
+
+
+def parsePGMFrame(buffer):
+    """
+    Return a (height x width) view of an 8-bit P5 PGM image held in a
+    buffer, or None if it isn't one.
+    """
+    header = _parsePGMHeader(buffer)
+    if header is None:
+        return None
+    width, height, offset = header
+    if offset + width * height > len(buffer):
+        return None
+    return np.frombuffer(buffer, dtype = np.uint8, count = width * height,
+                         offset = offset).reshape(height, width)
+
+
+def _mapPGM(filename):
+    """
+    Memory-map a file if it starts with the P5 magic, otherwise None.
+    """
+    with open(filename, "rb") as f:
+        if f.read(2) != b"P5":
+            return None
+        try:
+            return mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        except ValueError:
+            return None
+
+
+def _parsePGMHeader(buffer):
+    """
+    Return the width, height and pixel data offset of an 8-bit P5 PGM
+    image, or None if it isn't one.
+    """
+    header = _PGM_HEADER.match(buffer)
+    if header is None:
+        return None
+    width, height, maxval = (int(f) for f in _PGM_FIELDS.findall(header.group(0)[2:]) if f)
+    if maxval != 255:
+        return None
+    return width, height, header.end()
+
+
+def readFrame(filename):
+    """
+    Read a whole frame image (a filename or the contents of the file, as
+    bytes) as a (height x width) uint8 array of luma values.  8-bit P5
+    PGM files are memory-mapped.
+    """
+    buffer = filename if isinstance(filename, bytes) else _mapPGM(filename)
+    frame = None if buffer is None else parsePGMFrame(buffer)
+    if frame is None:
+        frame = np.asarray(_openImage(filename).convert(mode = "L"))
+    return frame
+
+
+def _openImage(filename):
+    """
+    Open a frame image with PIL, from a filename or the file's contents.
+    """
+    return Image.open(io.BytesIO(filename) if isinstance(filename, bytes) else filename)
+
+
+def decodeLine(values, DEBUG = 0, name = "<line>", stats = None):
+    """
+    Decode the CC bytes from a single line of luma values
+
+    Parameters
+    ----------
+    values : The line as a 1D uint8 array (or anything numpy can convert)
+    DEBUG : turn on debugging
+    name : Name used to identify the line in messages
+    stats : A Stats to record the stage times and outcome in
+
+    Returns
+    -------
+    Two bytes of decoded data, or a pair of nulls if the line doesn't
+    contain a CC signal.
+
+    Raises
+    ------
+    ValueError if the line looks like CC data but fails the start bit
+    sanity check, the parity check or a bit falls outside of the line.
+
+    Notes
+    -----
+    This is the same algorithm described in decodeFrame, but with the
+    per-pixel loops done as array operations.  The results are identical.
+    """
+    pair, status, error = _decodeLine(values, DEBUG, name, stats)
+    if error:
+        raise ValueError(error)
+    return pair
+
+
+def decodeLineStatus(values, DEBUG = 0, name = "<line>", stats = None):
+    """
+    decodeLine, but returning the pair and its status (see decodeLines)
+    rather than raising a ValueError when the line fails.  On a bad tape
+    that's most of the lines, and this skips raising and catching an
+    exception for each of them.
+    """
+    return _decodeLine(values, DEBUG, name, stats)[:2]
+
+
+def _decodeLine(values, DEBUG, name, stats):
+    """
+    The work of decodeLine and decodeLineStatus:  returns the pair, the
+    status and the message for a ValueError (or None)
+    """
+    clock = stats.clock() if stats else None
+    values = np.asarray(values, dtype = np.uint8)
+    width = len(values)
 
     # if maxluma is less than 32 (1/8 brightness), then it's just a black 
     # line, so there can't be data
+    maxluma = int(values.max()) if width else 0
     if maxluma < 32:
-        return (0, 0)
-        
+        if stats: stats.lap("threshold", clock, STATUS_BLACK)
+        return (0, 0), STATUS_BLACK, None
+
     # convert the values into 0 & 1 based on whether or not the signal
-    # is above or below the 25 IRE mark.
-    #  BUT, use a hysteresis for values in the middle 10% to avoid issues
-    #  with a wobbly signal.
-    lastVal = 0
-    for x in range(len(values)):
-        v = math.floor(100 * (values[x] / maxluma))
-        if 45 <= v <= 55:
-            values[x] = lastVal
-        else:
-            values[x] = 1 if v > 50 else 0
-        lastVal = values[x]
+    # is above or below the 25 IRE mark, with a hysteresis for values in
+    # the middle 10%.  Values in the hysteresis band take the last value
+    # outside of it, so mark them and forward-fill.  The leading 0 is the
+    # starting value of the fill.
+    v = np.floor(100 * (values / maxluma))
+    known = np.ones(width + 1, dtype = bool)
+    known[1:] = (v < 45) | (v > 55)
+    levels = np.zeros(width + 1, dtype = np.int8)
+    levels[1:] = v > 50
+    fill = np.maximum.accumulate(np.where(known, np.arange(width + 1), 0))
+    bits = levels[fill][1:]
+    if stats: clock = stats.lap("threshold", clock)
 
     # find the leading edge of the run-in
-    startRunIn = 0
-    for x in range(len(values)):
-        if values[x] == 1:
-            startRunIn = x
-            break
-        
+    startRunIn = int(np.argmax(bits))
+
     # if that start position is > 5% of the whole run, then it is too
     # late to be a CC frame.  Just send back a pair of NUL bytes
     if startRunIn > width * 0.05:
-        return (0, 0)
+        if stats: stats.lap("run-in", clock, STATUS_LATE_RUNIN)
+        return (0, 0), STATUS_LATE_RUNIN, None
 
     if DEBUG:
         print(f"First 1 at position {startRunIn} < {width * 0.05}.  maxluma = {maxluma}",
               file = sys.stderr)
 
     # now find the length of the run-in.  It should be 13 value changes
-    # since the wave crosses the center point a total of 14 times and
-    # startRunIn is at the first crossing.
-    lastVal = 1
-    count = 0;
-    stopRunIn = 0
-    for x in range(startRunIn, len(values)):
-        if values[x] != lastVal:
-            lastVal = values[x]
-            count = count + 1
-            if count == 13:
-                stopRunIn = x
-                break
+    # after startRunIn, and the 13th one is the end of the run-in.
+    edges = np.flatnonzero(bits[startRunIn + 1:] != bits[startRunIn:-1])
+    stopRunIn = int(edges[12]) + startRunIn + 1 if len(edges) >= 13 else 0
     if DEBUG:
         print(f"Run-in stop: {stopRunIn} ({0.2 * width}, {0.3 * width})",
               file = sys.stderr)
-            
+
     # if we didn't find 13 more transitions, it's not a valid CC frame
     if stopRunIn == 0:
-        return (0, 0)
+        if stats: stats.lap("run-in", clock, STATUS_NO_RUNIN)
+        return (0, 0), STATUS_NO_RUNIN, None
 
-    # if the run-in (which is 25.1% of the data) was less than 20% of the
-    # whole data set OR it was more than 30% of the data set, then it was
-    # the wrong size (or not actually the run in at all) and the CC is
-    # invalid.
+    # the run-in must be 20% - 30% of the line (see decodeFrame)
     if stopRunIn < (0.2 * width) or stopRunIn > (0.3 * width):        
-        return (0, 0)
+        if stats: stats.lap("run-in", clock, STATUS_RUNIN_SIZE)
+        return (0, 0), STATUS_RUNIN_SIZE, None
 
-    # Now that we know the length of the run-in, and we know it's 25.1% of
-    # the data, then we know the length of the data and that should give us
-    # everything we need to decode the frame.
     runInLength = stopRunIn - startRunIn
     dataSpan = runInLength / 0.251
-
-    # now we can tell how wide a bit is.  
     bitWidth = math.ceil(dataSpan * 0.038)
 
-    # we can also determine when the bits start.  We just have to look for
-    # the first 1 bit after the stopRunIn and add 1 bit width to it.  The
-    # dead zone and start bit will have negative offets in getBit, but the
-    # rest should be in a natural position.
-    bitStart = stopRunIn
-    while values[bitStart] == 0 and bitStart < width - 1:
-        bitStart = bitStart + 1
+    # the bits start one bit width after the first 1 following the run-in
+    # (or the end of the line, if there isn't one)
+    rising = np.flatnonzero(bits[stopRunIn:])
+    bitStart = stopRunIn + int(rising[0]) if len(rising) else width - 1
     bitStart = bitStart + bitWidth
-        
+    if stats: clock = stats.lap("run-in", clock)
+
     if DEBUG:
         print(f"Run-in length: {runInLength}, Data span: {dataSpan}, bit width: {bitWidth}",
               file =sys.stderr)
 
+    # Sample all of the bits at once:  the two dead bits and the start bit
+    # (-3, -2, -1) and then the 16 data bits.  Samples which are out of
+    # the range of the line are -1.
+    positions = np.arange(-3, 16)
+    offsets = np.trunc(bitStart + (positions * bitWidth) + (bitWidth / 2)).astype(np.int64)
+    inRange = (offsets >= 0) & (offsets <= width - 1)
+    samples = np.where(inRange, bits[np.clip(offsets, 0, width - 1)], -1)
+    if stats: stats.lap("sampling", clock)
 
-    def getBit(bit):
-        """
-        Sample a given bit within the data area.  If the number is
-        negative, it will be the start bit (-1) or either of the two
-        dead bits (-2 or -3).  If the value is out of range of the data,
-        then -1 will be returned.
-        """
-        offset = int(bitStart + (bit * bitWidth) + (bitWidth / 2))
-        # if we're out of range, return a sentinel.
-        if offset > (len(values) - 1) or offset < 0:
-            return -1
-        if DEBUG:
+    if DEBUG:
+        for bit, offset in zip(positions[inRange], offsets[inRange]):
             print(f"bit: {bit}, offset: {offset} ", end='', file = sys.stderr)
             for x in range(math.floor(bitWidth)):
                 o = int(math.floor(bitStart + (bit * bitWidth) + x))
+                if o >= width:
+                    break
                 if o == offset:
-                    print(f">>{values[o]}<<", end='', flush=True,
+                    print(f">>{bits[o]}<<", end='', flush=True,
                           file =sys.stderr)
                 else:
-                    print(values[o], end='', flush=True, file = sys.stderr)
+                    print(bits[o], end='', flush=True, file = sys.stderr)
             print(file = sys.stderr)
-        return values[offset]
 
+    # One last sanity check:  the there's two low bits (the dead space)
+    # and a start bit.  we should have 0, 0, 1 for those bits.  
+    sanity = tuple(int(s) for s in samples[:3])
+    if DEBUG:
+        print(f"Sanity: {sanity}", file = sys.stderr)
+    if (0, 0, 1) != sanity:
+        if stats: stats.count(STATUS_SANITY)
+        return (0, 0), STATUS_SANITY, f"Start bit sanity check failed on {name} -- got {sanity} rather than (0, 0, 1)"
+
+    data = []
+    weights = 1 << np.arange(7)
+    for base in (0, 8):
+        byteBits = samples[3 + base:3 + base + 7]
+        if (byteBits == -1).any():
+            # bit location is out of range
+            bit = base + int(np.argmax(byteBits == -1))
+            if stats: stats.count(STATUS_RANGE)
+            return (0, 0), STATUS_RANGE, f"Computed location for bit {bit} in file {name} is out of range"
+        byte = int(byteBits @ weights)
+        parity = int(byteBits.sum())
+
+        # Odd parity, so parity count + the parity bit should be an
+        # odd number.  If not, it's invalid.
+        if (int(samples[3 + base + 7]) + parity) & 1 != 1:
+            if stats: stats.count(STATUS_PARITY)
+            return (0, 0), STATUS_PARITY, f"Parity check in file {name} for byte starting at bit {base} failed."
 
-    try:
-        data = []    
-        # One last sanity check:  the there's two low bits (the dead space)
-        # and a start bit.  we should have 0, 0, 1 for those bits.  
-        sanity = (getBit(-3), getBit(-2), getBit(-1))
-        if DEBUG:
-            print(f"Sanity: {sanity}", file = sys.stderr)
-        if (0, 0, 1) != sanity:
-            raise ValueError(f"Start bit sanity check failed on {filename} -- got {sanity} rather than (0, 0, 1)")
-
-        for base in (0, 8):
-            byte = 0
-            parity = 0
-            for b in range(0, 7):
-                v = getBit(base + b)
-                if v == -1:
-                    # bit location is out of range
-                    raise ValueError(f"Computed location for bit {base + b} in file {filename} is out of range")
-                if v:
-                    byte = byte + (1 << b)
-                    parity = parity + 1
-                    
-            # Odd parity, so parity count + the parity bit should be an
-            # odd number.  If not, it's invalid.
-            if (getBit(base + 7) + parity) & 1 != 1:
-                raise ValueError(f"Parity check in file {filename} for byte starting at bit {base} failed.")
-
-            if DEBUG:
-                print(f"Final Byte Value: {byte}", file = sys.stderr)
-            data.append(byte)
-        return data
-    except ValueError as e:
         if DEBUG:
-            pass
-        else:
-            print(f"Value Exception: {e}", file = sys.stderr)
-            return (0, 0)
+            print(f"Final Byte Value: {byte}", file = sys.stderr)
+        data.append(byte)
+    if stats: stats.count(STATUS_OK)
+    return data, STATUS_OK, None
 
 
-def getByteStream(images, line, threads = None, DEBUG = 0):
+def decodeLines(lines, details = False, stats = None, subpixel = False):
     """
-    Multithreaded bytestream decode for all of the given images.  A byte
-    array of the raw data is returned.
+    Decode the CC bytes from a stack of lines all at once
+
+    Parameters
+    ----------
+    lines : A 2D uint8 array of luma values, one line per row
+    details : Also return the measurements of each row
+    stats : A Stats to record the stage times and outcomes in
+    subpixel : Time the bits with fitClock rather than from the whole
+               pixels of the run-in
+
+    Returns
+    -------
+    A tuple of a (rows x 2) uint8 array of the decoded bytes and a uint8
+    array with one STATUS_* code per row.  Rows that didn't decode have
+    a pair of nulls.  With details, a third item is a dict of per-row
+    arrays:  maxluma, startRunIn, stopRunIn, bitStart (the start of data
+    bit 0), bitWidth and margin (how close the luma of the closest of the
+    19 samples was to the 50% threshold, or 0 if any of them were out of
+    the line).  These are only meaningful as far as the row got before it
+    was rejected.
+
+    Notes
+    -----
+    This is the decodeLine algorithm with every step done across all of
+    the rows at once, so the results are identical to calling decodeLine
+    on each row (unless subpixel is on).  The working arrays are a few
+    times the size of the input, so a few thousand rows at a time is
+    plenty.
+
+    decodeLine rounds the bit width up to a whole pixel and starts the
+    bits at a whole pixel, so the error adds up over the 19 bits it
+    samples, and at low resolutions (under 400 pixels or so) the last
+    bits are sampled in the wrong place.  With subpixel, the bit width
+    and start are fractions of a pixel, which fixes that.  The rows are
+    still found and rejected the same way, and bitStart and bitWidth in
+    the details are floats.
     """
-    pool = Pool(threads)
-    iterArgs = []
-    for i in images:
-        iterArgs.append([i, line, DEBUG])
-    results = pool.starmap(decodeFrame, iterArgs)
-    if DEBUG:
-        print(results, file = sys.stderr)
-    bytes = bytearray()
-    for r in results:
-        for b in r: bytes.append(b)
-    return bytes
+    lines = np.asarray(lines, dtype = np.uint8)
+    if lines.ndim != 2:
+        raise ValueError(f"Expected a 2D array of lines, got {lines.ndim} dimensions")
+    rows, width = lines.shape
+    if width == 0:
+        raise ValueError("Expected lines with at least one value")
+    clock = stats.clock() if stats else None
+    column = np.arange(width)
+    status = np.full(rows, STATUS_OK, dtype = np.uint8)
+    pending = np.ones(rows, dtype = bool)
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description = "Extract CC data from frame images")
-    parser.add_argument("--threads",
-                        default = None,
-                        dest = 'threads',
-                        type = int,
-                        help = "Number of CPUs to use")
-    parser.add_argument("--debug",
-                        action = "store_true",
-                        default = False,
-                        help = "Turn on debugging")
-    parser.add_argument("--output",
-                        type = argparse.FileType('w'),
-                        dest = "output",
-                        default = sys.stdout,
-                        help = "Bitstream output file (defaults to stdout)")
-    parser.add_argument("ccline",
-                        type = int,
-                        help = "Frame line containing CC data")
-    parser.add_argument("file-or-dir",
-                        nargs = '+',
-                        help = "Frame image files or directories")
-    args = vars(parser.parse_args(sys.argv[1:]))
-    files = []
-    for f in args["file-or-dir"]:
-        if os.path.isfile(f):
-            files.append(f)
-        elif os.path.isdir(f):
-            for i in os.listdir(f):
-                file = os.path.join(f, i)
-                if os.path.isfile(file):
-                    files.append(file)
-            files.sort()
-        else:
-            print(f"Not a file or directory: {f}")
-            sys.exit(1)
-    bytes = getByteStream(files, args["ccline"], args["threads"], args["debug"])
+    def reject(failed, code):
+        failed = failed & pending
+        status[failed] = code
+        pending[failed] = False
+
+    maxluma = lines.max(axis = 1)
+    reject(maxluma < 32, STATUS_BLACK)
+
+    # threshold with the hysteresis forward-filled from a leading 0.  The
+    # lookup and fill indexes are kept small since they're the bulk of
+    # the work.
+    levels = np.zeros((rows, width + 1), dtype = np.int8)
+    levels[:, 1:] = _LEVELS.ravel().take((maxluma.astype(np.uint16) << 8)[:, None] | lines)
+    index = np.int16 if width < np.iinfo(np.int16).max else np.int64
+    fill = np.where(levels >= 0, np.arange(width + 1, dtype = index), index(0))
+    np.maximum.accumulate(fill, axis = 1, out = fill)
+    bits = np.take_along_axis(levels, fill, axis = 1)[:, 1:]
+    if stats: clock = stats.lap("threshold", clock, frames = rows)
+
+    startRunIn = np.argmax(bits, axis = 1)
+    reject(startRunIn > width * 0.05, STATUS_LATE_RUNIN)
+
+    # the 13th transition after startRunIn is the end of the run-in.  It
+    # can only be the right size if it's in the first 30% of the line, so
+    # only that much needs to be counted out.
+    edges = np.zeros((rows, width), dtype = bool)
+    edges[:, 1:] = (bits[:, 1:] != bits[:, :-1]) & (column[1:] > startRunIn[:, None])
+    found = edges.sum(axis = 1) >= 13
+    count = np.cumsum(edges[:, :int(0.3 * width) + 1], axis = 1, dtype = np.int16)
+    late = found & (count[:, -1] < 13)
+    stopRunIn = np.where(found & ~late, np.argmax(count >= 13, axis = 1), 0)
+    stopRunIn[late] = width
+    reject(~found, STATUS_NO_RUNIN)
+    reject((stopRunIn < (0.2 * width)) | (stopRunIn > (0.3 * width)), STATUS_RUNIN_SIZE)
+
+    runInLength = stopRunIn - startRunIn
+    dataSpan = runInLength / 0.251
+    bitWidth = np.ceil(dataSpan * 0.038).astype(np.int64)
+
+    rising = (bits == 1) & (column >= stopRunIn[:, None])
+    bitStart = np.where(rising.any(axis = 1), np.argmax(rising, axis = 1), width - 1)
+    bitStart = bitStart + bitWidth
+    if subpixel:
+        bitStart = bitStart.astype(float)
+        bitWidth = bitWidth.astype(float)
+        timed = np.flatnonzero(pending)
+        bitStart[timed], bitWidth[timed] = fitClock(lines[timed], edges[timed, :int(0.3 * width) + 1],
+                                                    startRunIn[timed], maxluma[timed])
+    if stats: clock = stats.lap("run-in", clock, frames = rows)
+
+    # sample the dead bits, start bit and data bits for every row
+    positions = np.arange(-3, 16)
+    offsets = np.trunc(bitStart[:, None] + (positions * bitWidth[:, None]) +
+                       (bitWidth[:, None] / 2)).astype(np.int64)
+    inRange = (offsets >= 0) & (offsets <= width - 1)
+    samples = np.take_along_axis(bits, np.clip(offsets, 0, width - 1), axis = 1)
+    samples = np.where(inRange, samples, -1)
+
+    reject((samples[:, 0] != 0) | (samples[:, 1] != 0) | (samples[:, 2] != 1), STATUS_SANITY)
+
+    pairs = np.zeros((rows, 2), dtype = np.uint8)
+    weights = 1 << np.arange(7)
+    for i, base in enumerate((0, 8)):
+        byteBits = samples[:, 3 + base:3 + base + 7]
+        reject((byteBits == -1).any(axis = 1), STATUS_RANGE)
+        # odd parity, including the parity bit (which may be -1)
+        parity = byteBits.sum(axis = 1) + samples[:, 3 + base + 7]
+        reject(parity & 1 != 1, STATUS_PARITY)
+        pairs[:, i] = byteBits @ weights
+
+    pairs[status != STATUS_OK] = 0
+    if stats:
+        stats.lap("sampling", clock, frames = rows)
+        stats.counts(status)
+    if details:
+        luma = np.take_along_axis(lines, np.clip(offsets, 0, width - 1), axis = 1)
+        margin = np.abs(2 * luma.astype(np.int16) - maxluma[:, None]) // 2
+        margin = np.where(inRange.all(axis = 1), margin.min(axis = 1), 0).astype(np.uint8)
+        return pairs, status, {"maxluma": maxluma, "startRunIn": startRunIn,
+                               "stopRunIn": stopRunIn, "bitStart": bitStart,
+                               "bitWidth": bitWidth, "margin": margin}
+    return pairs, status
+
+
+def fitClock(lines, edges, startRunIn, maxluma):
+    """
+    Measure the bit timing of lines from their run-ins, to a fraction of
+    a pixel
+
+    Parameters
+    ----------
+    lines : A 2D uint8 array of luma values, one line per row
+    edges : A 2D bool array that's True at the first pixel of each
+            thresholded level after startRunIn, with at least 13 of them
+            in each row (see decodeLines)
+    startRunIn : The first pixel of the run-in in each row
+    maxluma : The maximum luma of each row
+
+    Returns
+    -------
+    Float arrays of bitStart and bitWidth for each row, the same as the
+    ones decodeLines finds:  bitStart is half a pixel past the start of
+    data bit 0, so truncating the middle of a bit gives the nearest pixel.
+
+    Notes
+    -----
+    The run-in is 7 cycles of the bit clock, so its 14 crossings of 50%
+    (7 rises and 7 falls) are half a bit apart.  Each crossing is placed
+    between the two pixels on either side of 50% by linear interpolation,
+    looking back a few pixels from where the thresholded level changed
+    in case the hysteresis held it.  A least squares line through the 14
+    crossings gives the bit width (twice the slope) and the middle of the
+    last fall, and data bit 0 starts 3 bits after that (see
+    decodeFrame).
+    """
+    rows, width = lines.shape
+    # the pixels where the levels change:  the start of the run-in, and
+    # the first 13 edges after it
+    r, c = np.nonzero(edges)
+    rank = np.arange(len(r)) - np.searchsorted(r, np.arange(rows))[r]
+    keep = rank < 13
+    crossings = np.zeros((rows, 14), dtype = np.int64)
+    crossings[:, 0] = startRunIn
+    crossings[r[keep], rank[keep] + 1] = c[keep]
+
+    # look for the 50% crossing between each of the last 4 pairs of pixels
+    # up to the edge, rising on the even crossings and falling on the odd
+    threshold = maxluma.astype(float)[:, None, None] / 2
+    b = crossings[:, :, None] - np.arange(4)
+    a = np.clip(b - 1, 0, width - 1)
+    direction = np.where(np.arange(14) % 2, -1.0, 1.0)[None, :, None]
+    row = np.arange(rows)[:, None, None]
+    before = (lines[row, a] - threshold) * direction
+    after = (lines[row, np.clip(b, 0, width - 1)] - threshold) * direction
+    crossed = (before < 0) & (after >= 0) & (b >= 1)
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        position = a - before / (after - before)
+    first = np.argmax(crossed, axis = 2)[:, :, None]
+    position = np.where(crossed.any(axis = 2),
+                        np.take_along_axis(position, first, axis = 2)[:, :, 0],
+                        crossings - 0.5)
+
+    k = np.arange(14) - 6.5
+    slope = (position * k).sum(axis = 1) / (k * k).sum()
+    middle = position.mean(axis = 1)
+    # the last fall is at k = 6.5, and data bit 0 starts 3 bits (6
+    # half-bits) later
+    return middle + 12.5 * slope + 0.5, 2 * slope
+
+
+def decodeRows(frames, stats = None, subpixel = False):
+    """
+    Decode frames that each have one or more rows with the same CC data
+    (like the rows of one field of the CC band on a worn tape), working
+    harder on the frames where the CC line itself doesn't decode
+
+    Parameters
+    ----------
+    frames : A 3D (frames x rows x width) uint8 array of luma values.  The
+             first row of each frame is the CC line, and the rest are
+             there to fall back on.
+    stats : A Stats to record the stage times, outcomes and strategies in
+    subpixel : Use subpixel timing (see decodeLines) for the fast path
+               too.  The other tiers always do.
+
+    Returns
+    -------
+    A (frames x 2) uint8 array of the decoded bytes, a uint8 array of
+    STATUS_* codes (of the CC line, for the frames that didn't decode at
+    all) and a uint8 array of STRATEGY_* codes.
+
+    Notes
+    -----
+    Every frame goes through the fast path, and each of the other
+    strategies (tiers) is tried in order on just the frames that are
+    left, from the cheapest to the most expensive:
+
+    * line:  the CC line on its own (decodeLines)
+    * subpixel:  the CC line with subpixel timing (unless that's what
+      line was).  This is only for a single row, since the tiers after
+      it use subpixel timing anyway, and every retry of the same noisy
+      line is another chance for garbage to pass the parity check.
+    * average:  the mean of the rows, which averages out the noise
+    * vote:  every row is sampled at the bit positions found in the row
+      that got the furthest, and each bit goes to the majority.  Samples
+      in the hysteresis band don't vote, and ties fail.
+    * row:  the first of the other rows that decodes on its own
+    * adaptive:  the CC line (and then the average) with adaptive
+      thresholds (see adaptLines) and subpixel timing
+
+    Average, vote and row need more than one row, and like subpixel (and
+    the adaptive average), they only get the frames where the run-in was
+    found on the CC line, so a frame without CC doesn't pick up whatever
+    the other rows carry.  The tiers after subpixel only get the frames
+    where a row has a contrast of at least 32 (after a 3 pixel median
+    filter, so a few sparkles don't count), so a tape without CC doesn't
+    cost much more than the fast path.  On a clean tape only a few
+    percent of the frames get past it, so this is close to the speed of
+    decodeLines.  The fast path is only as good as its timing, though:
+    below 400 pixels or so, mistimed lines can pass the parity check, so
+    use subpixel there.  With stats, the time for each tier is the "tier"
+    stage of that name.
+    """
+    frames = np.asarray(frames, dtype = np.uint8)
+    count, rows, width = frames.shape
+    clock = stats.clock() if stats else None
+    result, outcome = decodeLines(frames[:, 0], subpixel = subpixel)
+    strategy = np.where(outcome == STATUS_OK, STRATEGY_LINE, STRATEGY_NONE).astype(np.uint8)
+    if stats: clock = stats.lap("tier line", clock, frames = count)
+
+    def tier(code, found, decoded):
+        ok = decoded[1] == STATUS_OK
+        result[found[ok]] = decoded[0][ok]
+        strategy[found[ok]] = code
+        if stats:
+            return stats.lap(f"tier {STRATEGY_NAMES[code]}", clock, frames = len(found))
+
+    # subpixel timing only changes anything once the run-in is found
+    failed = np.flatnonzero(np.isin(outcome, (STATUS_SANITY, STATUS_RANGE, STATUS_PARITY)))
+    if len(failed) and not subpixel and rows == 1:
+        clock = tier(STRATEGY_SUBPIXEL, failed, decodeLines(frames[failed, 0], subpixel = True))
+
+    # the rest of the tiers only get the frames with a row that has
+    # enough contrast to carry data
+    failed = np.flatnonzero(strategy == STRATEGY_NONE)
+    if len(failed):
+        median = _median3(frames[failed])
+        contrast = (median.max(axis = 2).astype(int) - median.min(axis = 2)).max(axis = 1)
+        candidates = failed[contrast >= 32]
 
-    print(bytes.decode('ascii'), file = args["output"])
+    failed = candidates[strategy[candidates] == STRATEGY_NONE] if len(failed) else failed
+    # the other rows can carry other data (the field 2 line, say), so
+    # they're only used for the frames where the CC line has a run-in
+    runIn = np.isin(outcome, (STATUS_SANITY, STATUS_RANGE, STATUS_PARITY))
+    found = failed[runIn[failed]]
+    if len(found) and rows > 1:
+        average = np.round(frames[found].mean(axis = 1)).astype(np.uint8)
+        clock = tier(STRATEGY_AVERAGE, found, decodeLines(average, subpixel = True))
 
+    found = found[strategy[found] == STRATEGY_NONE]
+    if len(found) and rows > 1:
+        # the rows of the frames that are left, each on its own
+        pairs, status, measured = decodeLines(frames[found].reshape(-1, width), details = True,
+                                              subpixel = True)
+        pairs = pairs.reshape(-1, rows, 2)
+        status = status.reshape(-1, rows)
 
+        # the row to take the bit positions from:  one that got as far as
+        # the parity check, or failing that, found the bits
+        score = np.select([np.isin(status, (STATUS_OK, STATUS_PARITY)),
+                           np.isin(status, (STATUS_SANITY, STATUS_RANGE))], [2, 1], 0)
+        reference = np.argmax(score, axis = 1)
+        usable = np.flatnonzero(score[np.arange(len(found)), reference] > 0)
+        reference = reference[usable]
+        bitStart = measured["bitStart"].reshape(-1, rows)[usable, reference]
+        bitWidth = measured["bitWidth"].reshape(-1, rows)[usable, reference]
+        offsets = np.trunc(bitStart[:, None] + (np.arange(-3, 16) * bitWidth[:, None]) +
+                           (bitWidth[:, None] / 2)).astype(np.int64)
+        inRange = (offsets >= 0) & (offsets <= width - 1)
+        samples = np.take_along_axis(frames[found[usable]],
+                                     np.clip(offsets, 0, width - 1)[:, None, :], axis = 2)
+        maxluma = measured["maxluma"].reshape(-1, rows)[usable]
+        levels = np.where(inRange[:, None, :], _LEVELS[maxluma[:, :, None], samples], -1)
+        ones = (levels == 1).sum(axis = 1)
+        zeros = (levels == 0).sum(axis = 1)
+        voted = np.where(ones > zeros, 1, np.where(zeros > ones, 0, -1))
+        ok = (voted[:, :3] == (0, 0, 1)).all(axis = 1) & (voted[:, 3:] >= 0).all(axis = 1)
+        ok &= (voted[:, 3:11].sum(axis = 1) & 1 == 1) & (voted[:, 11:].sum(axis = 1) & 1 == 1)
+        weights = 1 << np.arange(7)
+        votes = np.zeros((len(usable), 2), dtype = np.uint8)
+        votes[:, 0] = voted[:, 3:10] @ weights
+        votes[:, 1] = voted[:, 11:18] @ weights
+        clock = tier(STRATEGY_VOTE, found[usable],
+                     (votes, np.where(ok, STATUS_OK, STATUS_PARITY)))
+
+        left = strategy[found] == STRATEGY_NONE
+        decoded = status[left, 1:] == STATUS_OK
+        row = np.argmax(decoded, axis = 1) + 1
+        clock = tier(STRATEGY_ROW, found[left],
+                     (pairs[left][np.arange(left.sum()), row],
+                      np.where(decoded.any(axis = 1), STATUS_OK, STATUS_SANITY)))
+
+    failed = failed[strategy[failed] == STRATEGY_NONE]
+    if len(failed):
+        clock = tier(STRATEGY_ADAPTIVE, failed,
+                     decodeLines(adaptLines(frames[failed, 0]), subpixel = True))
+    found = failed[runIn[failed] & (strategy[failed] == STRATEGY_NONE)]
+    if len(found) and rows > 1:
+        average = np.round(frames[found].mean(axis = 1)).astype(np.uint8)
+        clock = tier(STRATEGY_ADAPTIVE, found, decodeLines(adaptLines(average), subpixel = True))
+
+    outcome[strategy != STRATEGY_NONE] = STATUS_OK
+    if stats:
+        stats.counts(outcome)
+        stats.countStrategies(strategy)
+    return result, outcome, strategy
+
+
+def adaptLines(lines):
+    """
+    Clean up a stack of lines for adaptive thresholds:  each line is run
+    through a 3 pixel median filter, which takes out dropouts and
+    sparkles, and then stretched so its black level is 0 and its peak
+    is 255.  The black level and peak are the 5th and 95th percentiles
+    of the line, so a few very bright or dark pixels don't throw off the
+    50% threshold (which with decodeLines is half of the brightest
+    pixel), and neither does a raised black level.
+    """
+    median = _median3(np.asarray(lines, dtype = np.uint8)).astype(float)
+    low, high = np.percentile(median, (5, 95), axis = 1, keepdims = True)
+    stretched = (median - low) * 255 / np.maximum(high - low, 1)
+    return np.clip(np.round(stretched), 0, 255).astype(np.uint8)
+
+
+def _median3(lines):
+    """
+    A 3 pixel median filter along the last axis, keeping the ends
+    """
+    padded = np.concatenate((lines[..., :1], lines, lines[..., -1:]), axis = -1)
+    a, b, c = padded[..., :-2], padded[..., 1:-1], padded[..., 2:]
+    return np.maximum(np.minimum(a, b), np.minimum(np.maximum(a, b), c))
+
+
+def voteRows(line, rows):
+    """
+    The rows for decodeRows around a CC line:  the line itself, then the
+    ones two away, alternating below and above, and so on.  Those are
+    the lines of the same field in an interlaced frame; the ones next to
+    it are the other field, which has its own CC (or nothing).
+    """
+    return [line + (i + 1) // 2 * (2 if i % 2 else -2) for i in range(rows)]
+
+
+def sampleLines(lines, geometry):
+    """
+    Decode a stack of lines by sampling them at the positions found in an
+    earlier line, without looking for the run-in
+
+    Parameters
+    ----------
+    lines : A 2D uint8 array of luma values, one line per row
+    geometry : A (startRunIn, stopRunIn, bitStart, bitWidth) tuple from a
+               line that decoded
+
+    Returns
+    -------
+    The same as decodeLines, except that rows which don't match the
+    geometry are STATUS_SANITY or STATUS_PARITY and should be decoded
+    the long way.
+
+    Notes
+    -----
+    Within a capture the run-in and the bits land in the same place from
+    frame to frame, so most lines only need a few samples:  the middle of
+    the 13 run-in half-cycles (which must alternate 1, 0, 1...), the dead
+    bits and start bit (0, 0, 1) and the 16 data bits.  Any sample in the
+    hysteresis band fails, since there's no earlier value to fall back on.
+    """
+    lines = np.asarray(lines, dtype = np.uint8)
+    rows, width = lines.shape
+    startRunIn, stopRunIn, bitStart, bitWidth = geometry
+    halfCycle = (stopRunIn - startRunIn) / 13
+    runIn = (startRunIn + halfCycle * (np.arange(13) + 0.5)).astype(np.int64)
+    data = np.trunc(bitStart + (np.arange(-3, 16) * bitWidth) + (bitWidth / 2)).astype(np.int64)
+    offsets = np.concatenate((runIn, data))
+    expected = np.concatenate((1 - np.arange(13) % 2, (0, 0, 1)))
+
+    pairs = np.zeros((rows, 2), dtype = np.uint8)
+    status = np.full(rows, STATUS_SANITY, dtype = np.uint8)
+    maxluma = lines.max(axis = 1) if width else np.zeros(rows, dtype = np.uint8)
+    if offsets.min() < 0 or offsets.max() >= width:
+        return pairs, status
+
+    samples = _LEVELS[maxluma[:, None], lines[:, offsets]]
+    sane = (samples[:, :16] == expected).all(axis = 1)
+    data = samples[:, 16:]
+    ok = sane & (data >= 0).all(axis = 1)
+    ok &= (data[:, :8].sum(axis = 1) & 1 == 1) & (data[:, 8:].sum(axis = 1) & 1 == 1)
+    status[sane & ~ok] = STATUS_PARITY
+    status[ok] = STATUS_OK
+    status[maxluma < 32] = STATUS_BLACK
+    weights = 1 << np.arange(7)
+    pairs[ok, 0] = data[ok, :7] @ weights
+    pairs[ok, 1] = data[ok, 8:15] @ weights
+    return pairs, status
+
+
+def decodeLinesLocked(lines, geometry = None, stats = None, subpixel = False):
+    """
+    Decode a stack of lines, using sampleLines with a known geometry and
+    only falling back to decodeLines for the rows that fail
+
+    Parameters
+    ----------
+    lines : A 2D uint8 array of luma values, one line per row
+    geometry : The geometry from an earlier call, or None
+    stats : A Stats to record the stage times and outcomes in
+    subpixel : Use subpixel timing for the rows that go the long way, and
+               so for the geometry (see decodeLines)
+
+    Returns
+    -------
+    The pairs and status as for decodeLines, and the geometry to pass on
+    to the next call:  the one from the last row that needed the long way
+    and decoded, or the one that was passed in.
+    """
+    lines = np.asarray(lines, dtype = np.uint8)
+    if geometry is None:
+        pairs = np.zeros((len(lines), 2), dtype = np.uint8)
+        status = np.full(len(lines), STATUS_SANITY, dtype = np.uint8)
+    else:
+        clock = stats.clock() if stats else None
+        pairs, status = sampleLines(lines, geometry)
+        if stats: stats.lap("locked sampling", clock, frames = len(lines))
+    failed = (status == STATUS_SANITY) | (status == STATUS_PARITY)
+    if stats: stats.counts(status[~failed])
+    if failed.any():
+        p, s, measured = decodeLines(lines[failed], details = True, stats = stats,
+                                     subpixel = subpixel)
+        pairs[failed] = p
+        status[failed] = s
+        good = np.flatnonzero(s == STATUS_OK)
+        if len(good):
+            geometry = tuple(measured[k][good[-1]].item()
+                             for k in ("startRunIn", "stopRunIn", "bitStart", "bitWidth"))
+    return pairs, status, geometry
+
+
+# The geometry for decodeFrameStatus (and _decodeShared) with lock, which
+# is kept from frame to frame within each process.
+_geometry = None
+
+
+def decodeFrameStatus(filename, line, DEBUG, stats = None, lock = False, vote = 1,
+                      subpixel = False, tiered = False, details = False):
+    """
+    decodeFrame, but using decodeLineStatus (or with subpixel,
+    decodeLines, or with lock, decodeLinesLocked with the geometry from
+    the last frame this process decoded, or with vote > 1 or tiered,
+    decodeRows on that many rows around the line).  Returns the pairs (a
+    2D array) and status for each line, and with details, their
+    detailRecords.
+    """
+    global _geometry
+    clock = stats.clock() if stats else None
+    values = _readRows(filename, line, vote)
+    if stats: stats.lap("read", clock, frames = len(values))
+    measured = None
+    if values.ndim == 3 or tiered:
+        pairs, status, strategy = decodeRows(values if values.ndim == 3 else values[:, None],
+                                             stats, subpixel)
+        if DEBUG:
+            print(f"File: {filename}, Line: {line}, Status: {[STATUS_NAMES[s] for s in status]}, "
+                  f"Strategy: {[STRATEGY_NAMES[s] for s in strategy]}", file = sys.stderr)
+    else:
+        if lock:
+            pairs, status, _geometry = decodeLinesLocked(values, _geometry, stats, subpixel)
+        elif details:
+            pairs, status, measured = decodeLines(values, True, stats, subpixel)
+        elif subpixel:
+            pairs, status = decodeLines(values, stats = stats, subpixel = subpixel)
+        else:
+            # one or two lines are quicker one at a time
+            decoded = [decodeLineStatus(v, DEBUG, filename, stats) for v in values]
+            pairs = np.array([pair for pair, s in decoded], dtype = np.uint8)
+            status = np.array([s for pair, s in decoded], dtype = np.uint8)
+        if DEBUG:
+            print(f"File: {filename}, Line: {line}, Status: {[STATUS_NAMES[s] for s in status]}"
+                  + (f", Geometry: {_geometry}" if lock else ""), file = sys.stderr)
+    if details:
+        return pairs, status, detailRecords(pairs, status, values, measured, subpixel)
+    return pairs, status
+
+
+def detailRecords(pairs, status, lines, measured = None, subpixel = False):
+    """
+    Pack decoded lines into a DETAIL_DTYPE array
+
+    Parameters
+    ----------
+    pairs, status : What the lines decoded to, from any of the decoders
+    lines : The lines they were decoded from, as a 2D uint8 array (or 3D
+            for decodeRows, where the first row of each frame is the one
+            that's measured)
+    measured : The details from decodeLines, if that's what decoded them.
+               Otherwise the lines are measured again with decodeLines.
+    subpixel : Measure with subpixel timing (see decodeLines)
+
+    Notes
+    -----
+    The measurements are always the decodeLines ones for the line itself,
+    even when a fallback like decodeRows found the bytes somewhere else,
+    since they're there to show how good the line is.  The run-in start
+    is capped at 65535.
+    """
+    if measured is None:
+        lines = np.asarray(lines, dtype = np.uint8)
+        measured = decodeLines(lines[:, 0] if lines.ndim == 3 else lines, True,
+                               subpixel = subpixel)[2]
+    records = np.zeros(len(pairs), dtype = DETAIL_DTYPE)
+    records["first"] = pairs[:, 0]
+    records["second"] = pairs[:, 1]
+    records["status"] = status
+    records["maxluma"] = measured["maxluma"]
+    records["startRunIn"] = np.minimum(measured["startRunIn"], 65535)
+    records["bitWidth"] = measured["bitWidth"]
+    records["margin"] = measured["margin"]
+    return records
+
+
+def scoreLines(frames):
+    """
+    Score every line of a stack of frames on how much it looks like it
+    carries CC data
+
+    Parameters
+    ----------
+    frames : A 3D (frames x height x width) uint8 array of luma values
+
+    Returns
+    -------
+    An array with one score per line.  Lines are ranked first by the
+    number of frames where they have a run-in of the right size (7 cycles
+    ending 20% - 30% of the way in), and then by the number of frames
+    where they decoded.  Lines with no run-in at all score 0.
+    """
+    frames = np.asarray(frames, dtype = np.uint8)
+    count, height, width = frames.shape
+    pairs, status = decodeLines(frames.reshape(-1, width))
+    status = status.reshape(count, height)
+    runIn = (status == STATUS_OK) | (status >= STATUS_SANITY)
+    return runIn.sum(axis = 0) * (count + 1) + (status == STATUS_OK).sum(axis = 0)
+
+
+def detectLine(frames, fields = False):
+    """
+    Find the line in a stack of frames that carries the CC data
+
+    Parameters
+    ----------
+    frames : A 3D (frames x height x width) uint8 array of luma values
+    fields : Find one line per field instead
+
+    Returns
+    -------
+    The best line, or None if no line has a run-in.  With fields, a pair
+    of the best even and odd lines (in that order), either of which may
+    be None.
+    """
+    scores = scoreLines(frames)
+
+    def best(candidates):
+        if len(candidates) == 0 or scores[candidates].max() == 0:
+            return None
+        return int(candidates[np.argmax(scores[candidates])])
+
+    lines = np.arange(len(scores))
+    if fields:
+        return best(lines[0::2]), best(lines[1::2])
+    return best(lines)
+
+
+def detectImageLine(images, fields = False, samples = 32):
+    """
+    Find the CC line (see detectLine) from up to samples frame images,
+    spread evenly through the images.  Images that aren't the same size
+    as the first one are skipped.
+    """
+    picks = np.unique(np.linspace(0, len(images) - 1, min(samples, len(images))).astype(int))
+    frames = []
+    for i in picks:
+        frame = readFrame(images[i])
+        if not frames or frame.shape == frames[0].shape:
+            frames.append(frame)
+    if not frames:
+        return (None, None) if fields else None
+    return detectLine(np.stack(frames), fields)
+
+
+# The ways iterByteStream can spread the work out:  a process per CPU
+# decoding frame by frame, a process per CPU fed lines through shared
+# memory, a thread per CPU decoding batches, or just this thread.
+EXECUTORS = ("process", "shared", "thread", "serial")
+
+
+def getByteStream(images, line, threads = None, DEBUG = 0, chunksize = 64,
+                  lock = False, stats = None, executor = "process"):
+    """
+    Multithreaded bytestream decode for all of the given images.  A byte
+    array of the raw data is returned.
+    """
+    bytes = bytearray()
+    for pair in iterByteStream(images, line, threads, DEBUG, chunksize, lock,
+                               stats, executor):
+        bytes += pair
+    return bytes
+
+
+def iterByteStream(images, line, threads = None, DEBUG = 0, chunksize = 64,
+                   lock = False, stats = None, executor = "process", status = False,
+                   vote = 1, subpixel = False, tiered = False, details = False, pool = None):
+    """
+    Multithreaded bytestream decode for all of the given images, yielding
+    the two bytes for each image (in order) as soon as they're decoded.
+
+    Parameters
+    ----------
+    images : The frame image filenames
+    line : The line (in the image) where the CC data appears
+    threads : Number of processes (or threads) to use (defaults to the CPU
+              count)
+    DEBUG : turn on debugging
+    chunksize : Number of images handed to a process (or thread) at a time
+    lock : Reuse the run-in geometry from frame to frame (see
+           decodeFrameStatus)
+    stats : A Stats to record the stage times and outcomes in.  Each
+            process records its own for each frame and sends them back
+            with the result; the time that takes is the "ipc" stage.
+    executor : One of EXECUTORS.  "process" decodes each frame in a Pool
+               of processes, "shared" uses iterSharedByteStream, "thread"
+               uses iterThreadByteStream, and "serial" decodes everything
+               in this thread with decodeBatches.
+    status : Follow the two bytes for each image with a third, its status
+             (see decodeLines)
+    vote : Read this many rows around the line and fall back on them for
+           the frames where the line doesn't decode (see decodeRows).
+           This takes the place of lock.
+    subpixel : Time the bits to a fraction of a pixel (see decodeLines)
+    tiered : Try harder on the frames that don't decode (see decodeRows).
+             Like vote, this takes the place of lock.
+    details : Yield a DETAIL_DTYPE record for each image instead (see
+              detailRecords).  They start with the same three bytes as
+              status.
+    pool : A Pool to use with "process" rather than starting one (and
+           terminating it at the end).  It's left running, so callers
+           that decode lots of short lists can share one.
+
+    Notes
+    -----
+    Only the results which are done but waiting on an earlier frame are
+    held in memory, so memory use doesn't grow with the number of images.
+    Larger chunksizes have less overhead, but the output comes in bigger
+    bursts.  With "process", the chunks are made smaller for a list that
+    wouldn't give every process one.  Except with "process", the frames
+    are decoded in batches, so DEBUG only prints the outcome counts for
+    each batch.
+    """
+    if executor == "shared":
+        yield from iterSharedByteStream(readLineBatches(images, line, vote = vote), threads,
+                                        lock, stats, status = status, subpixel = subpixel,
+                                        tiered = tiered, details = details)
+        return
+    if executor == "thread":
+        yield from iterThreadByteStream(_chunks(images, chunksize),
+                                        partial(readLineBatches, line = line, vote = vote),
+                                        threads, lock, stats, DEBUG, status, subpixel, tiered,
+                                        details)
+        return
+    if executor == "serial":
+        yield from decodeBatches(readLineBatches(images, line, vote = vote), lock, stats, DEBUG,
+                                 status, subpixel, tiered, details)
+        return
+    if executor != "process":
+        raise ValueError(f"Unknown executor: {executor}")
+    # the processes send back the status (or details) with the pairs,
+    # except with DEBUG, where decodeFrame prints how each frame went
+    records = status or details or lock or not DEBUG
+    if records:
+        decoder = partial(_frameRecords, lock = lock, vote = vote, subpixel = subpixel,
+                          tiered = tiered, details = details)
+    else:
+        decoder = partial(decodeFrame, vote = vote, subpixel = subpixel, tiered = tiered)
+    if stats:
+        decoder = partial(_timedDecode, decoder)
+    # a short list (like a window from iterAdaptiveByteStream) is still
+    # spread over all of the processes
+    threads = threads or os.cpu_count()
+    chunksize = max(1, min(chunksize, len(images) // threads))
+    owned = pool is None
+    if owned:
+        pool = Pool(threads)
+    try:
+        for r in pool.imap(partial(decoder, line = line, DEBUG = DEBUG),
+                           images, chunksize):
+            if stats:
+                r, frameStats, sent = r
+                stats.merge(frameStats)
+                stats.time("ipc", max(time.time() - sent, 0))
+            if DEBUG and records:
+                # the pairs, not the records
+                step = DETAIL_DTYPE.itemsize if details else 3
+                print(tuple(r[i + j] for i in range(0, len(r), step) for j in (0, 1)),
+                      file = sys.stderr)
+            elif DEBUG:
+                print(r, file = sys.stderr)
+            if not records:
+                yield bytes(r)
+            elif status or details:
+                yield r
+            else:
+                yield bytes(b for i, b in enumerate(r) if i % 3 != 2)
+    finally:
+        if owned:
+            pool.terminate()
+
+
+def _frameRecords(filename, line, DEBUG, stats = None, lock = False, vote = 1,
+                  subpixel = False, tiered = False, details = False):
+    """
+    decodeFrameStatus for the processes in iterByteStream:  returns the
+    pairs and status for each line as 3 bytes (or with details, the
+    DETAIL_DTYPE records), which are a lot quicker to send back than
+    arrays.
+    """
+    r = decodeFrameStatus(filename, line, DEBUG, stats, lock, vote, subpixel, tiered, details)
+    return r[2].tobytes() if details else np.column_stack(r).tobytes()
+
+
+def iterCachedByteStream(images, line, cache, threads = None, DEBUG = 0,
+                         chunksize = 64, lock = False, stats = None,
+                         executor = "process", batch = 1024, vote = 1, subpixel = False,
+                         status = False, tiered = False, details = False, pool = None):
+    """
+    iterByteStream, but with a ResultCache:  the frames that are in the
+    cache come from there and the rest are decoded (with the same
+    options) and added to it.  The bytes are still yielded in order.
+    Cached frames count towards the stats outcomes, and looking them up
+    is the "cache" stage.  With a list of lines, each line is cached on
+    its own, and a frame is decoded if any of them isn't cached.  Results
+    decoded with lock, vote, tiered or subpixel are cached apart from the
+    plain ones.  With status, each pair is followed by its status, and
+    with details, each line gets a DETAIL_DTYPE record, as with
+    iterByteStream.  The cache only keeps the bytes and status, so the
+    measurements are all 0 in the records of the cached frames.  pool is
+    passed on to iterByteStream.
+    """
+    if vote > 1:
+        decoder = f"{DECODER_VERSION}-vote{vote}"
+    elif tiered:
+        decoder = DECODER_VERSION + "-tiered"
+    else:
+        decoder = DECODER_VERSION + ("-lock" if lock else "")
+    if subpixel:
+        decoder += "-subpixel"
+    lines = line if isinstance(line, (tuple, list)) else [line]
+    clock = stats.clock() if stats else None
+    keys = [cache.key(image) for image in images]
+    found = [cache.lookup(keys, l, decoder) for l in lines]
+    records = [None if None in r else b"".join(r) for r in zip(*found)]
+    misses = [image for image, record in zip(images, records) if record is None]
+    if stats:
+        stats.lap("cache", clock, frames = len(images))
+        hits = [record[2::3] for record in records if record is not None]
+        stats.counts(np.frombuffer(b"".join(hits), dtype = np.uint8))
+
+    decoded = iterByteStream(misses, line, threads, DEBUG, chunksize, lock, stats,
+                             executor, status = True, vote = vote, subpixel = subpixel,
+                             tiered = tiered, details = details, pool = pool)
+    step = DETAIL_DTYPE.itemsize if details else 3
+    padding = bytes(step - 3)
+    size = step * len(lines)
+    buffer = b""
+    offset = 0
+    output = bytearray()
+    new = []
+    for key, record in zip(keys, records):
+        if record is None:
+            while len(buffer) - offset < size:
+                # pass on what's done before waiting on the decoder
+                if output:
+                    yield bytes(output)
+                    output.clear()
+                buffer = buffer[offset:] + next(decoded)
+                offset = 0
+            record = buffer[offset:offset + size]
+            offset += size
+            new.append((key, record))
+            if len(new) == batch:
+                _storeRecords(cache, new, lines, decoder, step)
+                new = []
+        elif details:
+            record = b"".join(record[i:i + 3] + padding for i in range(0, len(record), 3))
+        if details:
+            output += record
+        else:
+            for i in range(0, size, step):
+                output += record[i:i + 3] if status else record[i:i + 2]
+    if output:
+        yield bytes(output)
+    if new:
+        _storeRecords(cache, new, lines, decoder, step)
+
+
+def _storeRecords(cache, entries, lines, decoder, step = 3):
+    """
+    Store (key, record) entries with a step byte record for each line in
+    the cache, line by line.  Only the first 3 bytes (the pair and status)
+    of each line are kept.
+    """
+    for i, line in enumerate(lines):
+        cache.store([(key, record[step * i:step * i + 3]) for key, record in entries], line,
+                    decoder)
+
+
+def iterAdaptiveByteStream(images, decode, lines = 1, probe = 30, gap = 300, stats = None,
+                           details = False, status = False):
+    """
+    Bytestream decode that only decodes every probe'th frame until one of
+    them has CC, yielding the bytes for the frames in order (with a pair
+    of nulls for the frames that weren't decoded).
+
+    Parameters
+    ----------
+    images : The frame image filenames
+    decode : A function that decodes a list of images and yields their
+             bytes with the status, like iterByteStream with status (or
+             with details, if details is on).  It's called with a stats
+             keyword, which is a Stats of its own for each call (or None).
+    lines : The number of lines decoded from each frame
+    probe : Decode one frame in this many while there's no CC
+    gap : Go back to probing after this many frames in a row without CC
+    stats : A Stats to record the stage times and outcomes in, and count
+            the skipped frames in
+    details : Yield the DETAIL_DTYPE records from decode rather than just
+              the bytes.  The skipped frames get records of zeros with
+              STATUS_SKIPPED.
+    status : Follow the two bytes for each line with its status, which is
+             STATUS_SKIPPED for the skipped frames
+
+    Notes
+    -----
+    Long stretches of a tape (like the programme itself, between the
+    captions, or the whole tape if it isn't captioned) have no CC at all,
+    and reading every frame of them is the bulk of the work.  A frame
+    only counts as empty if none of its lines has a run-in (see
+    STATUS_EMPTY), so a frame with CC that didn't decode still counts as
+    CC.  When a probe finds CC, the frames since the last empty probe are
+    decoded, and every frame after that is decoded until there are gap
+    empty frames in a row.  So the frames that are filled in with nulls
+    are always between two empty probes, and CC that's shorter than
+    probe frames can be missed.
+
+    decode is handed a window of frames at a time rather than everything
+    that's left, so closing it throws away at most one window of what it's
+    read and decoded ahead:  the probes in the next gap frames, and in a
+    stretch, the frames until it could next end (gap less the empty
+    frames it ends in so far).  Only the outcomes of the frames that are
+    used are counted in stats; the lines that were thrown away (including
+    a probe that found CC, which is decoded again with the frames around
+    it) are counted as discarded.
+    """
+    step = DETAIL_DTYPE.itemsize if details else 3
+    size = step * lines
+    if details:
+        null = np.zeros(lines, dtype = DETAIL_DTYPE)
+        null["status"] = STATUS_SKIPPED
+        null = null.tobytes()
+    elif status:
+        null = bytes((0, 0, STATUS_SKIPPED)) * lines
+    else:
+        null = bytes(2 * lines)
+    # the status of each line of the frames that were used, for the stats
+    used = []
+
+    def records(frames):
+        window = Stats() if stats else None
+        decoded = decode(frames, stats = window)
+        buffer = b""
+        try:
+            for data in decoded:
+                buffer += data
+                whole = len(buffer) - len(buffer) % size
+                for i in range(0, whole, size):
+                    yield buffer[i:i + size]
+                buffer = buffer[whole:]
+        finally:
+            decoded.close()
+            if stats:
+                decodedLines = sum(window.outcomes.values())
+                window.outcomes = {}
+                window.counts(np.frombuffer(b"".join(used), dtype = np.uint8))
+                window.discarded += decodedLines - sum(window.outcomes.values())
+                stats.merge(window)
+            used.clear()
+
+    def empty(record):
+        return all(record[i] in STATUS_EMPTY for i in range(2, size, step))
+
+    start = 0
+    while start < len(images):
+        # everything up to the last empty probe is empty
+        end = start
+        for probes in _chunks(range(start + probe - 1, len(images), probe),
+                              max(1, gap // probe)):
+            decoded = records([images[i] for i in probes])
+            for i, record in zip(probes, decoded):
+                if not empty(record):
+                    break
+                used.append(record[2::step])
+                end = i + 1
+            decoded.close()
+            if end <= probes[-1]:
+                break
+        if end > start:
+            if stats: stats.skipped += (end - start) - (end - start) // probe
+            yield null * (end - start)
+            start = end
+
+        # then every frame until there's a gap
+        run = 0
+        while start < len(images) and run < gap:
+            # the stretch can't end before these
+            decoded = records(images[start:start + gap - run])
+            for record in decoded:
+                start += 1
+                run = run + 1 if empty(record) else 0
+                used.append(record[2::step])
+                if details:
+                    yield record
+                else:
+                    yield b"".join(record[i:i + 3 if status else i + 2]
+                                   for i in range(0, size, 3))
+
+
+def _timedDecode(decoder, filename, line, DEBUG):
+    """
+    Run a frame decoder with a fresh Stats, and return the result, the
+    Stats and when it was sent.
+    """
+    stats = Stats()
+    r = decoder(filename, line, DEBUG, stats)
+    return r, stats, time.time()
+
+
+def statsStream(stream, stats, filename, interval = 0):
+    """
+    Pass a bytestream through, writing the stats to filename every
+    interval seconds (if interval isn't 0) and at the end.
+    """
+    last = time.time()
+    for chunk in stream:
+        yield chunk
+        if interval and time.time() - last >= interval:
+            stats.dump(filename)
+            last = time.time()
+    stats.dump(filename)
+
+
+def checkpointStream(stream, filename, interval = 60, data = b"", info = None):
+    """
+    Pass a bytestream through, saving everything that's come through so
+    far to a checkpoint file (see writeCheckpoint) every interval seconds
+    and at the end.
+
+    Parameters
+    ----------
+    stream : The bytestream
+    filename : The checkpoint file
+    interval : Seconds between checkpoints
+    data : The bytes from the checkpoint being resumed, which are passed
+           through first (so the output is complete) and saved with the
+           rest
+    info : A dict of anything else to save (to check against on resume)
+
+    Notes
+    -----
+    The bytes come through in frame order, so the checkpoint always has
+    every frame up to the last one saved, and a resumed run only has to
+    skip that many frames.
+    """
+    data = bytearray(data)
+    if data:
+        yield bytes(data)
+    last = time.time()
+    for chunk in stream:
+        data += chunk
+        yield chunk
+        if interval and time.time() - last >= interval:
+            writeCheckpoint(filename, data, info)
+            last = time.time()
+    writeCheckpoint(filename, data, info, done = True)
+
+
+def writeCheckpoint(filename, data, info = None, done = False):
+    """
+    Write a checkpoint:  a JSON file with the number of frames decoded,
+    their bytes (base64) and whether the run finished, plus what's in
+    info.  It's replaced in one go, so a run that's killed part way
+    through writing it leaves the last one.
+    """
+    checkpoint = dict(info or {})
+    checkpoint.update(frames = len(data) // 2, done = done,
+                      data = base64.b64encode(bytes(data)).decode("ascii"))
+    with open(filename + ".tmp", "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(filename + ".tmp", filename)
+
+
+def readCheckpoint(filename):
+    """
+    Read a checkpoint written by writeCheckpoint.  Returns the dict with
+    data decoded back to bytes, or None if there isn't one.
+    """
+    try:
+        with open(filename) as f:
+            checkpoint = json.load(f)
+    except FileNotFoundError:
+        return None
+    checkpoint["data"] = base64.b64decode(checkpoint["data"])
+    return checkpoint
+
+
+def skipFrames(stream, frames):
+    """
+    Drop the bytes for the first frames frames of a bytestream.
+    """
+    skip = 2 * frames
+    for chunk in stream:
+        if skip >= len(chunk):
+            skip -= len(chunk)
+            continue
+        yield chunk[skip:]
+        skip = 0
+
+
+def decodeBatches(batches, lock = False, stats = None, DEBUG = 0, status = False,
+                  subpixel = False, tiered = False, details = False):
+    """
+    Decode batches of lines (2D uint8 arrays) in this process, yielding the
+    bytes for each batch as it's decoded.  With lock, the run-in geometry
+    is carried from batch to batch (see decodeLinesLocked).  With stats,
+    the time waiting on the next batch is the "read" stage.  With status,
+    each line's two bytes are followed by its status.  3D batches (of
+    several rows for each frame) are decoded with decodeRows, without the
+    lock, and so are 2D ones with tiered.  subpixel is passed on to the
+    decoders (see decodeLines).  With details, each line gets a
+    DETAIL_DTYPE record instead (see detailRecords).
+    """
+    geometry = None
+    clock = stats.clock() if stats else None
+    for lines in batches:
+        if stats: stats.lap("read", clock, frames = len(lines))
+        measured = None
+        if lines.ndim == 3 or tiered:
+            pairs, outcome, strategy = decodeRows(lines if lines.ndim == 3 else lines[:, None],
+                                                  stats, subpixel)
+        elif lock:
+            pairs, outcome, geometry = decodeLinesLocked(lines, geometry, stats, subpixel)
+        elif details:
+            pairs, outcome, measured = decodeLines(lines, True, stats, subpixel)
+        else:
+            pairs, outcome = decodeLines(lines, stats = stats, subpixel = subpixel)
+        if DEBUG:
+            print(np.bincount(outcome, minlength = len(STATUS_NAMES)), file = sys.stderr)
+        if details:
+            yield detailRecords(pairs, outcome, lines, measured, subpixel).tobytes()
+        else:
+            yield np.column_stack((pairs, outcome)).tobytes() if status else pairs.tobytes()
+        if stats: clock = stats.clock()
+
+
+def iterThreadByteStream(jobs, read, threads = None, lock = False, stats = None,
+                         DEBUG = 0, status = False, subpixel = False, tiered = False,
+                         details = False):
+    """
+    Decode jobs with a pool of threads, yielding the bytes for each job in
+    order.
+
+    Parameters
+    ----------
+    jobs : An iterable of units of work, like lists of image filenames
+    read : A function that turns a job into an iterable of 2D uint8 arrays
+           of lines (or 3D ones for decodeRows, like readLineBatches)
+    threads : Number of threads to use (defaults to the CPU count)
+    lock : Reuse the run-in geometry within each job (see decodeBatches)
+    stats : A Stats to record the stage times and outcomes in
+    DEBUG : turn on debugging
+    status : Follow the two bytes for each line with its status
+    subpixel : Use subpixel timing (see decodeLines)
+    tiered : Use decodeRows (see decodeBatches)
+    details : Give each line a DETAIL_DTYPE record instead (see
+              detailRecords)
+
+    Notes
+    -----
+    There's no process startup, pickling or copying, and the threads get
+    to run side by side because reading the images and the NumPy work in
+    decodeLines let go of the GIL, so it's most useful where a process
+    pool is too heavy (like when this is a library in a long-running
+    service).  Each thread records its own Stats for each job, which are
+    merged here.  At most two jobs per thread are in flight.
+    """
+    threads = threads or os.cpu_count()
+    pending = deque()
+
+    def collect():
+        data, jobStats = pending.popleft().get()
+        if stats:
+            stats.merge(jobStats)
+        return data
+
+    with ThreadPool(threads) as pool:
+        for job in jobs:
+            if len(pending) >= 2 * threads:
+                yield collect()
+            pending.append(pool.apply_async(_decodeJob,
+                                            (read, job, lock, stats is not None, DEBUG,
+                                             status, subpixel, tiered, details)))
+        while pending:
+            yield collect()
+
+
+def _decodeJob(read, job, lock, timed, DEBUG, status, subpixel, tiered, details):
+    """
+    Read and decode a job for iterThreadByteStream.  Returns the bytes and
+    a Stats if timed.
+    """
+    stats = Stats() if timed else None
+    return b"".join(decodeBatches(read(job), lock, stats, DEBUG, status, subpixel,
+                                  tiered, details)), stats
+
+
+def _chunks(items, size):
+    """
+    Split a list into lists of up to size items
+    """
+    return (items[i:i + size] for i in range(0, len(items), size))
+
+
+def listFrames(directory, patterns = None, recursive = False):
+    """
+    Yield the paths of the frame files in a directory (unsorted)
+
+    Parameters
+    ----------
+    directory : The directory
+    patterns : Glob patterns (like "*.png"); only files that match one of
+               them are listed.  All files are listed if there are none.
+    recursive : List the files in the subdirectories too
+
+    Notes
+    -----
+    This uses os.scandir, which gets the file type along with the name,
+    so there's no stat per file.
+    """
+    match = None
+    if patterns:
+        match = re.compile("|".join(fnmatch.translate(p) for p in patterns)).match
+    directories = [directory]
+    while directories:
+        with os.scandir(directories.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    if recursive:
+                        directories.append(entry.path)
+                elif entry.is_file() and (match is None or match(entry.name)):
+                    yield entry.path
+
+
+_DIGITS = re.compile(r"(\d+)")
+
+
+def naturalKey(name):
+    """
+    Sort key that orders the numbers in a name by value, so frame2.png
+    comes before frame10.png (even if they aren't zero padded).  Paths
+    sort by directory first.
+    """
+    head, sep, tail = name.rpartition("/")
+    parts = _DIGITS.split(tail)
+    parts[1::2] = map(int, parts[1::2])
+    return _naturalDirectory(head), parts
+
+
+@lru_cache(maxsize = 1024)
+def _naturalDirectory(name):
+    # the directories repeat, so their keys are only worked out once
+    parts = _DIGITS.split(name)
+    parts[1::2] = map(int, parts[1::2])
+    return tuple(parts)
+
+
+def readLineBatches(images, line, batch = 1024, vote = 1):
+    """
+    Read the given line (or list of lines, see readLines) from each image,
+    yielding them as 2D uint8 arrays of up to batch lines.  A batch ends
+    early if the width changes.  With vote > 1, the voteRows around the
+    line are read instead, and the batches are 3D (frames x vote x width)
+    for decodeRows.
+    """
+    return _batchLines((values for image in images for values in _readRows(image, line, vote)),
+                       batch)
+
+
+def _batchLines(rows, batch):
+    """
+    Stack lines (or stacks of rows) into arrays of up to batch of them,
+    ending a batch early if the width changes.
+    """
+    lines = []
+    for values in rows:
+        if len(lines) == batch or (lines and values.shape != lines[0].shape):
+            yield np.stack(lines)
+            lines = []
+        lines.append(values)
+    if lines:
+        yield np.stack(lines)
+
+
+def iterSharedByteStream(batches, threads = None, lock = False, stats = None,
+                         batch = 1024, slots = None, status = False, subpixel = False,
+                         tiered = False, details = False):
+    """
+    Decode batches of lines with a pool of processes which share memory
+    with this one, yielding the bytes for each batch in order.
+
+    Parameters
+    ----------
+    batches : An iterable of 2D uint8 arrays of lines, all the same width
+              (or 3D arrays of rows for decodeRows, all the same shape)
+    threads : Number of processes to use (defaults to the CPU count)
+    lock : Reuse the run-in geometry (kept per process, see
+           decodeLinesLocked)
+    stats : A Stats to record the stage times and outcomes in
+    batch : The most lines handed to a process at a time
+    slots : The number of batches in the ring buffer (defaults to two per
+            process)
+    status : Follow the two bytes for each line with its status
+    subpixel : Use subpixel timing (see decodeLines)
+    tiered : Use decodeRows (see decodeBatches)
+    details : Give each line a DETAIL_DTYPE record instead (see
+              detailRecords)
+
+    Notes
+    -----
+    The lines are copied into a ring buffer of slots in shared memory, and
+    the processes write the pairs and status (or the details) for each
+    line into a second shared array at the same slot, so the only thing
+    that's pickled is the slot number (and the Stats, if there are any).
+    At most slots batches are in flight, so memory use is fixed.  A batch
+    that isn't the same shape as the first one is decoded in this
+    process.
+    """
+    from multiprocessing import shared_memory
+
+    batches = iter(batches)
+    first = next(batches, None)
+    if first is None:
+        return
+    shape = first.shape[1:]
+    processes = threads or os.cpu_count()
+    slots = slots or 2 * processes
+    lineMemory = shared_memory.SharedMemory(create = True,
+                                            size = slots * batch * int(np.prod(shape)))
+    size = DETAIL_DTYPE.itemsize if details else 3
+    resultMemory = shared_memory.SharedMemory(create = True, size = slots * batch * size)
+    try:
+        lines = np.ndarray((slots, batch) + shape, dtype = np.uint8, buffer = lineMemory.buf)
+        results = np.ndarray((slots, batch, size), dtype = np.uint8, buffer = resultMemory.buf)
+        pending = deque()
+        free = list(range(slots))
+
+        def collect():
+            slot, count, result = pending.popleft()
+            frameStats = result.get()
+            if stats:
+                stats.merge(frameStats)
+            free.append(slot)
+            return results[slot, :count, :size if details or status else 2].tobytes()
+
+        with Pool(processes, _attachShared,
+                  (lineMemory.name, resultMemory.name, slots, batch, shape, lock,
+                   subpixel, tiered, details)) as pool:
+            for frames in chain([first], batches):
+                if frames.shape[1:] != shape:
+                    while pending:
+                        yield collect()
+                    yield from decodeBatches([frames], stats = stats, status = status,
+                                             subpixel = subpixel, tiered = tiered,
+                                             details = details)
+                    continue
+                for start in range(0, len(frames), batch):
+                    chunk = frames[start:start + batch]
+                    if not free:
+                        yield collect()
+                    slot = free.pop()
+                    lines[slot, :len(chunk)] = chunk
+                    pending.append((slot, len(chunk),
+                                    pool.apply_async(_decodeShared,
+                                                     (slot, len(chunk), stats is not None))))
+            while pending:
+                yield collect()
+    finally:
+        # the views have to go before the memory can be closed
+        lines = results = None
+        lineMemory.close()
+        lineMemory.unlink()
+        resultMemory.close()
+        resultMemory.unlink()
+
+
+# The shared memory arrays for _decodeShared, set up in each process by
+# _attachShared.
+_shared = None
+
+
+def _attachShared(lineName, resultName, slots, batch, shape, lock, subpixel, tiered, details):
+    """
+    Pool initializer for iterSharedByteStream:  attach to the shared
+    memory.
+    """
+    global _shared
+    from multiprocessing import shared_memory
+    lineMemory = shared_memory.SharedMemory(name = lineName)
+    resultMemory = shared_memory.SharedMemory(name = resultName)
+    _shared = {
+        "memory": (lineMemory, resultMemory),
+        "lines": np.ndarray((slots, batch) + shape, dtype = np.uint8, buffer = lineMemory.buf),
+        "results": np.ndarray((slots, batch, DETAIL_DTYPE.itemsize if details else 3),
+                              dtype = np.uint8, buffer = resultMemory.buf),
+        "lock": lock,
+        "subpixel": subpixel,
+        "tiered": tiered,
+        "details": details,
+    }
+
+
+def _decodeShared(slot, count, timed):
+    """
+    Decode the lines in a slot of the shared ring buffer and write the
+    pairs and status (or the details) into the same slot of the results.
+    Returns a Stats if timed.
+    """
+    global _geometry
+    stats = Stats() if timed else None
+    lines = _shared["lines"][slot, :count]
+    subpixel = _shared["subpixel"]
+    measured = None
+    if lines.ndim == 3 or _shared["tiered"]:
+        pairs, status, strategy = decodeRows(lines if lines.ndim == 3 else lines[:, None],
+                                             stats, subpixel)
+    elif _shared["lock"]:
+        pairs, status, _geometry = decodeLinesLocked(lines, _geometry, stats, subpixel)
+    elif _shared["details"]:
+        pairs, status, measured = decodeLines(lines, True, stats, subpixel)
+    else:
+        pairs, status = decodeLines(lines, stats = stats, subpixel = subpixel)
+    if _shared["details"]:
+        records = detailRecords(pairs, status, lines, measured, subpixel)
+        _shared["results"][slot, :count] = records.view(np.uint8).reshape(count, -1)
+    else:
+        _shared["results"][slot, :count, :2] = pairs
+        _shared["results"][slot, :count, 2] = status
+    return stats
+
+
+def writeByteStream(stream, output, bufsize = 4096, raw = False):
+    """
+    Write the chunks of bytes from a bytestream to a text file as they
+    arrive, flushing every bufsize bytes or so.  With raw, output is a
+    binary file and the bytes are written as they are:  two per frame,
+    including the nulls, which is the same as the .raw file from
+    extract_cc_bytestream (and what ccextractor -in=raw reads).
+
+    output can also be a list of files, for a bytestream with two bytes
+    per line for several lines of each frame (like the line 21 of each
+    field):  each line's bytes go to its own file.
+    """
+    outputs = output if isinstance(output, list) else [output]
+    buffers = [bytearray() for o in outputs]
+    rest = b""
+    for chunk in stream:
+        if len(outputs) > 1:
+            chunks, rest = splitLines(rest + chunk, len(outputs))
+        else:
+            chunks = [chunk]
+        for buffer, chunk in zip(buffers, chunks):
+            buffer += chunk
+        if len(buffers[0]) >= bufsize:
+            for output, buffer in zip(outputs, buffers):
+                output.write(buffer if raw else buffer.decode('ascii'))
+                output.flush()
+                buffer.clear()
+    for output, buffer in zip(outputs, buffers):
+        if raw:
+            output.write(buffer)
+            output.flush()
+        else:
+            print(buffer.decode('ascii'), file = output)
+
+
+def splitLines(data, lines):
+    """
+    Split bytes with two per line for lines lines of each frame into a
+    list of the bytes for each line.  Returns the list and the bytes left
+    over from a partial frame at the end.
+    """
+    whole = len(data) - len(data) % (2 * lines)
+    frames = np.frombuffer(data, dtype = np.uint8, count = whole).reshape(-1, lines, 2)
+    return [frames[:, i].tobytes() for i in range(lines)], data[whole:]
+
+
+def captionStream(stream, writers, channel = 1, lines = 1):
+    """
+    Pass a bytestream through, decoding the captions in it as it goes and
+    writing them with each of the SubtitleWriters.  Frames are numbered
+    from the start of the stream.  If the bytestream has two lines for
+    each frame (field 1 and field 2, see writeByteStream), channels 1 and
+    2 come from the first and channels 3 and 4 from the second.
+    """
+    decoder = CaptionDecoder(channel)
+    rest = b""
+    for chunk in stream:
+        if lines > 1:
+            data, rest = splitLines(rest + chunk, lines)
+            cues = decoder.feed(data[(channel - 1) // 2])
+        else:
+            cues = decoder.feed(chunk)
+        for writer in writers:
+            writer.write(cues)
+        yield chunk
+    cues = decoder.finish()
+    for writer in writers:
+        writer.write(cues)
+
+
+class SidecarWriter:
+    """
+    Write a SIDECAR_DTYPE record for each line of each frame to a .npy
+    file as they're decoded, so the QC of a tape can be read back (or
+    memory mapped) with numpy.load(filename, mmap_mode = "r").
+
+    Parameters
+    ----------
+    filename : The .npy file to write
+    lines : The number of lines decoded from each frame
+    frame : The number of the first frame
+
+    Notes
+    -----
+    The records are packed (16 bytes each), and are only ever appended,
+    so the header has room for any number of them and is rewritten with
+    the count by close().  Until then it says there are none.
+    """
+
+    def __init__(self, filename, lines = 1, frame = 0):
+        self.lines = lines
+        self.frame = frame
+        self.count = 0
+        self.file = open(filename, "wb")
+        self.file.write(self._header(0))
+
+    def _header(self, count):
+        """
+        The .npy header for count records, padded to the same size
+        whatever the count is
+        """
+        header = repr({"descr": np.lib.format.dtype_to_descr(SIDECAR_DTYPE),
+                       "fortran_order": False, "shape": (count,)})
+        # the magic, length and newline, and room for a 20 digit count,
+        # rounded up to 64 bytes like numpy does
+        size = 64 * -(-(11 + len(header) - len(str(count)) + 20) // 64)
+        return (np.lib.format.magic(1, 0) + (size - 10).to_bytes(2, "little") +
+                header.ljust(size - 11).encode("latin1") + b"\n")
+
+    def write(self, records):
+        """
+        Write a DETAIL_DTYPE array of records, the lines of each frame in
+        order
+        """
+        index = self.count + np.arange(len(records))
+        out = np.zeros(len(records), dtype = SIDECAR_DTYPE)
+        out["frame"] = self.frame + index // self.lines
+        out["line"] = index % self.lines
+        for name in DETAIL_DTYPE.names:
+            out[name] = records[name]
+        self.file.write(out.tobytes())
+        self.count += len(records)
+
+    def close(self):
+        """
+        Put the number of records in the header and close the file
+        """
+        self.file.seek(0)
+        self.file.write(self._header(self.count))
+        self.file.close()
+
+
+def sidecarStream(stream, writer):
+    """
+    Turn a stream of DETAIL_DTYPE records (see detailRecords) into a
+    stream of pairs with their status (see failureStream), writing the
+    records with a SidecarWriter as they go by.
+    """
+    size = DETAIL_DTYPE.itemsize
+    rest = b""
+    for chunk in stream:
+        data = rest + chunk
+        whole = len(data) - len(data) % size
+        records = np.frombuffer(data, dtype = DETAIL_DTYPE, count = whole // size)
+        rest = data[whole:]
+        writer.write(records)
+        yield np.frombuffer(data, dtype = np.uint8, count = whole).reshape(-1, size)[:, :3].tobytes()
+
+
+def failureStream(stream, interval = 10):
+    """
+    Turn a stream of pairs with their status (see iterByteStream) back
+    into a bytestream, reporting the lines that have a run-in but didn't
+    decode on stderr:  how many there were of each STATUS_* code since
+    the last report, every interval seconds (if there were any, and if
+    interval isn't 0), and how many there were in all at the end.
+
+    This takes the place of a message for every line that fails, which
+    on a bad tape is most of them.
+    """
+    counts = np.zeros(256, dtype = np.int64)
+    reported = counts.copy()
+    last = time.time()
+    rest = b""
+    for chunk in stream:
+        data = rest + chunk
+        whole = len(data) - len(data) % 3
+        records = np.frombuffer(data, dtype = np.uint8, count = whole).reshape(-1, 3)
+        rest = data[whole:]
+        counts += np.bincount(records[:, 2], minlength = 256)
+        yield records[:, :2].tobytes()
+        if interval and time.time() - last >= interval:
+            summary = failureSummary(counts - reported)
+            if summary:
+                print(summary, file = sys.stderr)
+            reported = counts.copy()
+            last = time.time()
+    summary = failureSummary(counts)
+    if summary:
+        print(f"In all, {summary}", file = sys.stderr)
+
+
+def failureSummary(counts):
+    """
+    Summarize the counts of each STATUS_* code (an array indexed by code)
+    in a line, or return None if none of them are failures.  Lines
+    without a run-in (STATUS_EMPTY) aren't failures, and codes past
+    STATUS_NAMES (like STATUS_SKIPPED) aren't counted at all.
+    """
+    failed = [(name, int(counts[code])) for code, name in enumerate(STATUS_NAMES)
+              if code != STATUS_OK and code not in STATUS_EMPTY and counts[code]]
+    if not failed:
+        return None
+    total = int(counts[:len(STATUS_NAMES)].sum())
+    return (f"{sum(n for name, n in failed)} of {total} lines didn't decode:  " +
+            ", ".join(f"{n} {name}" for name, n in failed))
+
+
+# Files with these extensions are taken to be archives of frame images
+ARCHIVE_EXTENSIONS = (".tar", ".tgz", ".tar.gz", ".tbz2", ".tar.bz2", ".txz",
+                      ".tar.xz", ".zip")
+
+
+def isArchive(filename):
+    """
+    True if filename looks like a tar (optionally compressed) or zip
+    archive, going by the extension.
+    """
+    return filename.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def readArchiveLines(archive, line, batch = 1024, vote = 1):
+    """
+    Read the given line (or list of lines, see readLines) from each frame
+    image in a tar (optionally compressed) or zip archive, in name order
+    (see naturalKey), yielding them as 2D uint8 arrays of up to batch
+    lines.  A batch ends early if the width changes.  vote is the same as
+    with readLineBatches.
+
+    Notes
+    -----
+    Nothing is extracted to disk.  Zip files and plain tar files are
+    read one member at a time in name order.  A compressed tar can only
+    be read straight through, so it's read in the order it was written
+    and a copy of each line (not the frame) is kept until the end, when
+    they're sorted.
+    """
+    return _batchLines(_archiveLines(archive, line, vote), batch)
+
+
+def _archiveLines(archive, line, vote = 1):
+    if zipfile.is_zipfile(archive):
+        with zipfile.ZipFile(archive) as z:
+            for name in sorted((i.filename for i in z.infolist() if not i.is_dir()),
+                               key = naturalKey):
+                yield from _readRows(z.read(name), line, vote)
+        return
+    try:
+        tar = tarfile.open(archive, "r:")
+    except tarfile.ReadError:
+        tar = None
+    if tar is not None:
+        with tar:
+            for member in sorted((m for m in tar.getmembers() if m.isfile()),
+                                 key = lambda m: naturalKey(m.name)):
+                yield from _readRows(tar.extractfile(member).read(), line, vote)
+        return
+    lines = {name: np.array(_readRows(data, line, vote)) for name, data in _archiveFiles(archive)}
+    for name in sorted(lines, key = naturalKey):
+        yield from lines[name]
+
+
+def _archiveFiles(archive):
+    """
+    Yield the name and contents of each file in a zip or tar archive, in
+    the order they were written.
+    """
+    if zipfile.is_zipfile(archive):
+        with zipfile.ZipFile(archive) as z:
+            for info in z.infolist():
+                if not info.is_dir():
+                    yield info.filename, z.read(info)
+    else:
+        with tarfile.open(archive, "r|*") as tar:
+            for member in tar:
+                if member.isfile():
+                    yield member.name, tar.extractfile(member).read()
+
+
+def detectArchiveLine(archive, fields = False, samples = 32):
+    """
+    Find the CC line (see detectLine) from the first samples frame images
+    in an archive (in the order they were written, so a compressed tar
+    doesn't have to be read all the way through).  Images that aren't
+    the same size as the first one are skipped.
+    """
+    frames = []
+    for name, data in _archiveFiles(archive):
+        frame = readFrame(data)
+        if not frames or frame.shape == frames[0].shape:
+            frames.append(frame)
+        if len(frames) == samples:
+            break
+    if not frames:
+        return (None, None) if fields else None
+    return detectLine(np.stack(frames), fields)
+
+
+def iterArchiveByteStream(archive, line, DEBUG = 0, lock = False, stats = None,
+                          executor = "serial", threads = None, vote = 1, subpixel = False,
+                          tiered = False, details = False, status = False):
+    """
+    Bytestream decode for an archive of frame images (see
+    readArchiveLines), yielding the bytes for each batch of frames as
+    it's decoded.  If line is None, it's found with detectArchiveLine.
+    The executor, vote, subpixel, tiered, details and status are used the
+    same way as with iterVideoByteStream.
+    """
+    if executor not in EXECUTORS:
+        raise ValueError(f"Unknown executor: {executor}")
+    if line is None:
+        line = detectArchiveLine(archive)
+        if line is None:
+            raise ValueError(f"Couldn't find a CC line in {archive}")
+        print(f"Using CC line {line} for {archive}", file = sys.stderr)
+    yield from iterBatchByteStream(readArchiveLines(archive, line, vote = vote), threads, lock,
+                                   stats, executor, DEBUG, subpixel, tiered, details, status)
+
+
+def iterBatchByteStream(batches, threads = None, lock = False, stats = None,
+                        executor = "serial", DEBUG = 0, subpixel = False, tiered = False,
+                        details = False, status = False):
+    """
+    Decode batches of lines (2D uint8 arrays) that are already in memory,
+    yielding the bytes for each batch in order:  here with decodeBatches
+    ("serial"), by threads threads with iterThreadByteStream ("thread"),
+    or by threads processes with iterSharedByteStream ("process" or
+    "shared").
+    """
+    if executor == "serial":
+        yield from decodeBatches(batches, lock, stats, DEBUG, status, subpixel = subpixel,
+                                 tiered = tiered, details = details)
+    elif executor == "thread":
+        yield from iterThreadByteStream(batches, lambda lines: [lines], threads,
+                                        lock, stats, DEBUG, status, subpixel = subpixel,
+                                        tiered = tiered, details = details)
+    else:
+        yield from iterSharedByteStream(batches, threads, lock, stats, status = status,
+                                        subpixel = subpixel, tiered = tiered, details = details)
+
+
+# Line stores (see writeLineStore) start with this, and then the width,
+# the rows per frame, the number of frames and the frame rate
+LINESTORE_MAGIC = b"CCLINES1"
+_LINESTORE_HEADER = struct.Struct("<8sIIQd")
+
+
+def writeLineStore(filename, bands, framerate = 29.97):
+    """
+    Write a line store:  the CC band of every frame of a capture, packed
+    into one file that readLineStore can memory map
+
+    Parameters
+    ----------
+    filename : The file to write
+    bands : An iterable of 3D (frames x rows x width) uint8 arrays, all
+            with the same rows and width (like readVideoFrames or
+            readImageBands yield)
+    framerate : The frame rate of the capture
+
+    Returns
+    -------
+    The number of frames written
+
+    Notes
+    -----
+    The header is LINESTORE_MAGIC, the width, the rows and the number of
+    frames (little endian 32, 32 and 64 bit) and the frame rate (a
+    double), and the rows follow as raw bytes, frame by frame.  It's
+    written with 0 frames and filled in at the end, so a store that
+    wasn't finished reads as empty.
+    """
+    count = 0
+    shape = None
+    with open(filename, "wb") as f:
+        f.write(_LINESTORE_HEADER.pack(LINESTORE_MAGIC, 0, 0, 0, framerate))
+        for frames in bands:
+            if shape is None:
+                shape = frames.shape[1:]
+            elif frames.shape[1:] != shape:
+                raise ValueError(f"Frames of {frames.shape[2]}x{frames.shape[1]} don't match "
+                                 f"the {shape[1]}x{shape[0]} ones before them")
+            f.write(np.ascontiguousarray(frames, dtype = np.uint8))
+            count += len(frames)
+        rows, width = shape or (0, 0)
+        f.seek(0)
+        f.write(_LINESTORE_HEADER.pack(LINESTORE_MAGIC, width, rows, count, framerate))
+    return count
+
+
+def readLineStore(filename):
+    """
+    Memory map a line store (see writeLineStore).  Returns a read-only 3D
+    (frames x rows x width) uint8 array of the CC bands and the frame
+    rate.
+    """
+    with open(filename, "rb") as f:
+        header = f.read(_LINESTORE_HEADER.size)
+    if len(header) < _LINESTORE_HEADER.size or not header.startswith(LINESTORE_MAGIC):
+        raise ValueError(f"{filename} isn't a line store")
+    magic, width, rows, count, framerate = _LINESTORE_HEADER.unpack(header)
+    if count == 0:
+        return np.zeros((0, rows, width), dtype = np.uint8), framerate
+    return np.memmap(filename, dtype = np.uint8, mode = "r", offset = _LINESTORE_HEADER.size,
+                     shape = (count, rows, width)), framerate
+
+
+def isLineStore(filename):
+    """
+    True if filename is a line store, going by the magic at the start.
+    """
+    try:
+        with open(filename, "rb") as f:
+            return f.read(len(LINESTORE_MAGIC)) == LINESTORE_MAGIC
+    except OSError:
+        return False
+
+
+def readLineStoreLines(store, line, batch = 1024, vote = 1):
+    """
+    Read the given line (or list of lines) of every frame in a line store,
+    yielding them as 2D uint8 arrays of up to batch frames' lines.  With
+    vote > 1, the rows around the line (within the band) are read
+    instead, and the batches are 3D for decodeRows, as with
+    readLineBatches.
+
+    The batches are slices of the memory map, so a store is read
+    straight through, a batch at a time, with no decoding of images.
+    """
+    frames, framerate = readLineStore(store)
+    count, height, width = frames.shape
+    if count == 0:
+        return
+    if isinstance(line, (tuple, list)):
+        rows = list(line)
+    elif vote > 1:
+        rows = [r for r in voteRows(line, height) if 0 <= r < height][:vote]
+    else:
+        rows = [line]
+    for l in rows:
+        if not 0 <= l < height:
+            raise ValueError(f"CC line {l} is not in the {height} lines of {store}")
+    for start in range(0, count, batch):
+        if isinstance(line, (tuple, list)):
+            yield frames[start:start + batch, rows].reshape(-1, width)
+        elif vote > 1:
+            yield frames[start:start + batch, rows]
+        else:
+            yield frames[start:start + batch, line]
+
+
+def detectLineStoreLine(store, fields = False, samples = 32):
+    """
+    Find the CC line (see detectLine) from up to samples frames, spread
+    evenly through a line store.
+    """
+    frames, framerate = readLineStore(store)
+    if len(frames) == 0:
+        return (None, None) if fields else None
+    picks = np.unique(np.linspace(0, len(frames) - 1, min(samples, len(frames))).astype(int))
+    return detectLine(frames[picks], fields)
+
+
+def iterLineStoreByteStream(store, line, DEBUG = 0, lock = False, stats = None,
+                            executor = "serial", threads = None, vote = 1, subpixel = False,
+                            tiered = False, details = False, status = False):
+    """
+    Bytestream decode for a line store (see readLineStoreLines), yielding
+    the bytes for each batch of frames as it's decoded.  If line is None,
+    it's found with detectLineStoreLine.  The rest is the same as with
+    iterVideoByteStream.
+    """
+    if executor not in EXECUTORS:
+        raise ValueError(f"Unknown executor: {executor}")
+    if line is None:
+        line = detectLineStoreLine(store)
+        if line is None:
+            raise ValueError(f"Couldn't find a CC line in {store}")
+        print(f"Using CC line {line} for {store}", file = sys.stderr)
+    yield from iterBatchByteStream(readLineStoreLines(store, line, vote = vote), threads, lock,
+                                   stats, executor, DEBUG, subpixel, tiered, details, status)
+
+
+def readImageBands(images, batch = 256, rows = None):
+    """
+    Read the CC band of each frame image:  the given list of rows, or
+    every row (the whole CC band, for the frames extract_cc_bytestream
+    makes).  Yields 3D (frames x rows x width) uint8 arrays of up to batch
+    frames for writeLineStore.  Without rows, the images are taken to be
+    the height of the first one.  Rows outside of an image are black.
+    """
+    if not images:
+        return
+    rows = list(rows) if rows is not None else list(range(readFrame(images[0]).shape[0]))
+    for lines in readLineBatches(images, rows, batch * len(rows)):
+        yield lines.reshape(-1, len(rows), lines.shape[1])
+
+
+def readArchiveBands(archive, batch = 256, rows = None):
+    """
+    readImageBands for the frame images in an archive (see
+    readArchiveLines)
+    """
+    if rows is None:
+        for name, data in _archiveFiles(archive):
+            rows = range(readFrame(data).shape[0])
+            break
+        else:
+            return
+    rows = list(rows)
+    for lines in readArchiveLines(archive, rows, batch * len(rows)):
+        yield lines.reshape(-1, len(rows), lines.shape[1])
+
+
+def readVideoFrames(video, ccbase = 25, ccheight = 4, ffmpeg = "ffmpeg",
+                    batch = 1024, DEBUG = 0):
+    """
+    Read the CC band of every frame of a video through an ffmpeg pipe
+
+    Parameters
+    ----------
+    video : The video filename
+    ccbase : The first line of the frame to keep
+    ccheight : The number of lines to keep
+    ffmpeg : The ffmpeg binary
+    batch : The maximum number of frames to return at a time
+    DEBUG : turn on debugging
+
+    Yields
+    ------
+    uint8 arrays of (frames x ccheight x CROP_WIDTH) luma values, in frame
+    order.
+
+    Notes
+    -----
+    ffmpeg crops the frames the same way extract_cc_bytestream does and
+    writes them as raw 8-bit gray to a pipe, so the frames never touch
+    the disk.
+    """
+    command = [ffmpeg, "-loglevel", "error", "-i", video,
+               "-vf", f"crop=w={CROP_WIDTH}:h={ccheight}:y={ccbase}:x={CROP_X}",
+               "-pix_fmt", "gray", "-f", "rawvideo", "-"]
+    if DEBUG:
+        print(f"Running: {' '.join(command)}", file = sys.stderr)
+    frameSize = CROP_WIDTH * ccheight
+    with subprocess.Popen(command, stdout = subprocess.PIPE) as proc:
+        while True:
+            data = proc.stdout.read(frameSize * batch)
+            frames = len(data) // frameSize
+            if frames:
+                yield np.frombuffer(data, dtype = np.uint8, count = frames * frameSize).reshape(
+                    frames, ccheight, CROP_WIDTH)
+            if len(data) < frameSize * batch:
+                break
+    if proc.returncode:
+        raise RuntimeError(f"{ffmpeg} failed on {video} with exit code {proc.returncode}")
+
+
+def getVideoByteStream(video, line, ccbase = 25, ccheight = 4,
+                       ffmpeg = "ffmpeg", DEBUG = 0, lock = False, stats = None,
+                       executor = "serial", threads = None):
+    """
+    Bytestream decode for a video, read through an ffmpeg pipe.  The line
+    is relative to ccbase.  A byte array of the raw data is returned.
+    """
+    bytes = bytearray()
+    for chunk in iterVideoByteStream(video, line, ccbase, ccheight, ffmpeg,
+                                     DEBUG, lock, stats, executor, threads):
+        bytes += chunk
+    return bytes
+
+
+def iterVideoByteStream(video, line, ccbase = 25, ccheight = 4,
+                        ffmpeg = "ffmpeg", DEBUG = 0, lock = False, stats = None,
+                        executor = "serial", threads = None, vote = 1, subpixel = False,
+                        tiered = False, details = False, status = False):
+    """
+    Bytestream decode for a video, read through an ffmpeg pipe, yielding
+    the bytes for each batch of frames as it's decoded.  With lock, the
+    run-in geometry is carried from batch to batch (see decodeLinesLocked).
+    If line is None, it's found with detectVideoLine.  If it's a list of
+    lines, each frame gets two bytes for each of them.  The frames are
+    decoded with iterBatchByteStream, so "process" is the same as
+    "shared", since the frames are already in memory.  With vote > 1, the
+    rows around the line (within the ccheight lines) are decoded with
+    decodeRows, and so is the line on its own with tiered.  With
+    subpixel, the bits are timed to a fraction of a pixel (see
+    decodeLines).  With status, each line's bytes are followed by its
+    status, and with details, each line gets a DETAIL_DTYPE record
+    instead (see detailRecords).
+    """
+    if executor not in EXECUTORS:
+        raise ValueError(f"Unknown executor: {executor}")
+    batches = readVideoFrames(video, ccbase, ccheight, ffmpeg, DEBUG = DEBUG)
+    if line is None:
+        line, batches = detectVideoLine(batches)
+        if line is None:
+            raise ValueError(f"Couldn't find a CC line in {video}")
+        print(f"Using CC line {line} for {video}", file = sys.stderr)
+    for l in line if isinstance(line, (tuple, list)) else [line]:
+        if not 0 <= l < ccheight:
+            raise ValueError(f"CC line {l} is not in the {ccheight} lines starting at {ccbase}")
+    if isinstance(line, (tuple, list)):
+        lines = (frames[:, list(line)].reshape(-1, frames.shape[2]) for frames in batches)
+    elif vote > 1:
+        rows = [r for r in voteRows(line, ccheight) if 0 <= r < ccheight][:vote]
+        lines = (frames[:, rows] for frames in batches)
+    else:
+        lines = (frames[:, line] for frames in batches)
+    yield from iterBatchByteStream(lines, threads, lock, stats, executor, DEBUG, subpixel,
+                                   tiered, details, status)
+
+
+def detectVideoLine(batches, limit = 16):
+    """
+    Find the CC line (see detectLine) from batches of video frames, as
+    read by readVideoFrames.  Batches are read until a line is found (or
+    limit batches have been read), and they're handed back along with
+    the line so none of the frames are lost.
+
+    Returns
+    -------
+    The line (or None) and an iterator of all of the batches.
+    """
+    seen = []
+    line = None
+    for frames in batches:
+        seen.append(frames)
+        line = detectLine(frames[::max(1, len(frames) // 64)])
+        if line is not None or len(seen) >= limit:
+            break
+    return line, chain(seen, batches)
+
+
+def lineArgument(value):
+    """
+    argparse type for a frame line:  a line number or "auto"
+    """
+    if value == "auto":
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid line: {value!r} (expected a number or 'auto')")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Extract CC data from frame images")
+    parser.add_argument("--threads",
+                        default = None,
+                        dest = 'threads',
+                        type = int,
+                        help = "Number of CPUs to use")
+    parser.add_argument("--executor",
+                        default = "process",
+                        choices = EXECUTORS,
+                        help = "How to spread the decoding over the CPUs:  processes, processes fed through shared memory, threads, or none (default process)")
+    parser.add_argument("--chunksize",
+                        default = 64,
+                        type = int,
+                        help = "Number of frames handed to a CPU at a time (default 64)")
+    parser.add_argument("--debug",
+                        action = "store_true",
+                        default = False,
+                        help = "Turn on debugging")
+    parser.add_argument("--output",
+                        type = argparse.FileType('w'),
+                        dest = "output",
+                        default = sys.stdout,
+                        help = "Bitstream output file (defaults to stdout)")
+    parser.add_argument("--field2",
+                        type = lineArgument,
+                        default = False,
+                        help = "Also decode field 2 (CC3, CC4 and XDS) from this frame line (or 'auto'), in the same pass")
+    parser.add_argument("--field2-output",
+                        type = argparse.FileType('w'),
+                        help = "Bitstream output file for --field2")
+    parser.add_argument("--raw",
+                        action = "store_true",
+                        default = False,
+                        help = "Write the bytestream as binary, two bytes per frame (for ccextractor -in=raw)")
+    parser.add_argument("--vtt",
+                        type = argparse.FileType('w', encoding = 'utf-8'),
+                        help = "Also decode the captions to this WebVTT file")
+    parser.add_argument("--srt",
+                        type = argparse.FileType('w', encoding = 'utf-8'),
+                        help = "Also decode the captions to this SRT file")
+    parser.add_argument("--channel",
+                        default = 1,
+                        type = int,
+                        choices = (1, 2, 3, 4),
+                        help = "Caption channel for --vtt and --srt (default 1).  3 and 4 come from field 2, so they need --field2.")
+    parser.add_argument("--framerate",
+                        type = float,
+                        help = "Frame rate for caption times (default 29.97, or the one in a line store)")
+    parser.add_argument("--lock-geometry",
+                        action = "store_true",
+                        default = False,
+                        help = "Reuse the run-in geometry from frame to frame")
+    parser.add_argument("--vote",
+                        default = 1,
+                        type = int,
+                        help = "Read this many rows of the same field around the CC line and fall back on them for frames that don't decode (default 1)")
+    parser.add_argument("--subpixel",
+                        action = "store_true",
+                        default = False,
+                        help = "Time the bits to a fraction of a pixel (for frames narrower than 400 pixels or so)")
+    parser.add_argument("--tiered",
+                        action = "store_true",
+                        default = False,
+                        help = "Retry the frames that don't decode with slower, more robust decoders (always on with --vote)")
+    parser.add_argument("--stats",
+                        help = "Write stage timings and outcome counts to this JSON file")
+    parser.add_argument("--stats-interval",
+                        default = 0,
+                        type = float,
+                        help = "Also write --stats every this many seconds")
+    parser.add_argument("--report-interval",
+                        default = 10,
+                        type = float,
+                        help = "Seconds between the counts of the frames that didn't decode on stderr (default 10, 0 for just the total at the end)")
+    parser.add_argument("--checkpoint",
+                        help = "Save the bytes decoded so far to this file as the run goes")
+    parser.add_argument("--checkpoint-interval",
+                        default = 60,
+                        type = float,
+                        help = "Seconds between --checkpoint saves (default 60)")
+    parser.add_argument("--resume",
+                        action = "store_true",
+                        default = False,
+                        help = "Carry on from the frames in --checkpoint (if it's there)")
+    parser.add_argument("--cache",
+                        help = "Keep the decoded bytes in this cache file, and reuse them for frame files that haven't changed")
+    parser.add_argument("--cache-size",
+                        default = 1000000,
+                        type = int,
+                        help = "Most frames to keep in --cache (default 1000000)")
+    parser.add_argument("--probe",
+                        default = 0,
+                        type = int,
+                        help = "Only decode one frame file in this many until one has CC (default 0, decode every frame).  Not for archives, line stores, --video or --executor shared.")
+    parser.add_argument("--probe-gap",
+                        default = 300,
+                        type = int,
+                        help = "Go back to --probe after this many frames in a row without CC (default 300)")
+    parser.add_argument("--sidecar",
+                        help = "Also write the status and measurements of every frame to this .npy file")
+    parser.add_argument("--glob",
+                        action = "append",
+                        help = "Only use the files in the directories that match this pattern, like '*.png' (can be given more than once)")
+    parser.add_argument("--recursive",
+                        action = "store_true",
+                        default = False,
+                        help = "Also use the files in subdirectories")
+    parser.add_argument("--video",
+                        action = "store_true",
+                        default = False,
+                        help = "The files are videos to read through ffmpeg")
+    parser.add_argument("--ffmpeg",
+                        default = "ffmpeg",
+                        help = "The ffmpeg binary to use with --video")
+    parser.add_argument("--ccbase",
+                        default = 25,
+                        type = int,
+                        help = "First video line to read with --video (default 25)")
+    parser.add_argument("--ccheight",
+                        default = 4,
+                        type = int,
+                        help = "Number of video lines to read with --video (default 4)")
+    parser.add_argument("ccline",
+                        type = lineArgument,
+                        help = "Frame line containing CC data (relative to --ccbase with --video), or 'auto' to find it")
+    parser.add_argument("file-or-dir",
+                        nargs = '+',
+                        help = "Frame image files, directories, archives or line stores (or videos with --video)")
+    args = vars(parser.parse_args(sys.argv[1:]))
+    stats = Stats() if args["stats"] else None
+    # the field 1 and field 2 lines, or just the one line
+    dual = args["field2"] is not False
+    lines = [args["ccline"], args["field2"]] if dual else [args["ccline"]]
+    if dual and not args["field2_output"]:
+        print("--field2 needs --field2-output")
+        sys.exit(1)
+    if args["channel"] > 2 and not dual:
+        # CC3 and CC4 are in field 2, which is only decoded with --field2
+        print("--channel 3 and 4 need --field2")
+        sys.exit(1)
+    if args["vote"] < 1 or (dual and args["vote"] > 1):
+        print("--vote has to be at least 1, and can't be used with --field2")
+        sys.exit(1)
+    if args["probe"] < 0 or args["probe_gap"] < 1:
+        print("--probe can't be negative and --probe-gap has to be at least 1")
+        sys.exit(1)
+    if args["probe"] and (args["video"] or args["executor"] == "shared"):
+        # the shared executor would set up its processes and memory
+        # again for every handful of probes
+        print("--probe can't be used with --video or --executor shared")
+        sys.exit(1)
+    checkpoint = None
+    if args["resume"]:
+        if not args["checkpoint"]:
+            print("--resume needs --checkpoint")
+            sys.exit(1)
+        checkpoint = readCheckpoint(args["checkpoint"])
+    if checkpoint:
+        if checkpoint["sources"] != args["file-or-dir"] or checkpoint["video"] != args["video"]:
+            print(f"{args['checkpoint']} is for different files")
+            sys.exit(1)
+        saved = checkpoint["line"] if isinstance(checkpoint["line"], list) else [checkpoint["line"]]
+        if len(saved) != len(lines) or any(l is not None and l != s for l, s in zip(lines, saved)):
+            print(f"{args['checkpoint']} is for CC line {checkpoint['line']}")
+            sys.exit(1)
+        lines = saved
+        skip = checkpoint["frames"] // len(lines)
+        # only whole frames
+        checkpoint["data"] = checkpoint["data"][:2 * len(lines) * skip]
+        print(f"Resuming after {skip} frames", file = sys.stderr)
+    else:
+        skip = 0
+    resumed = skip
+    cache = ResultCache(args["cache"], args["cache_size"]) if args["cache"] else None
+    details = args["sidecar"] is not None
+    pool = None
+
+    if args["video"]:
+        for f in args["file-or-dir"]:
+            if not os.path.isfile(f):
+                print(f"Not a file: {f}")
+                sys.exit(1)
+        if dual and None in lines:
+            print("--video needs both lines with --field2")
+            sys.exit(1)
+        line = lines if dual else lines[0]
+        stream = chain.from_iterable(
+            iterVideoByteStream(f, line, args["ccbase"],
+                                args["ccheight"], args["ffmpeg"], args["debug"],
+                                args["lock_geometry"], stats,
+                                args["executor"], args["threads"], args["vote"],
+                                args["subpixel"], args["tiered"], details, status = True)
+            for f in args["file-or-dir"])
+    else:
+        # archives and line stores, and lists of the frame files between
+        # them
+        sources = []
+        for f in args["file-or-dir"]:
+            if os.path.isfile(f) and (isArchive(f) or isLineStore(f)):
+                sources.append(f)
+                if isLineStore(f) and args["framerate"] is None:
+                    args["framerate"] = readLineStore(f)[1]
+                continue
+            if not sources or not isinstance(sources[-1], list):
+                sources.append([])
+            files = sources[-1]
+            if os.path.isfile(f):
+                files.append(f)
+            elif os.path.isdir(f):
+                files.extend(listFrames(f, args["glob"], args["recursive"]))
+            else:
+                print(f"Not a file or directory: {f}")
+                sys.exit(1)
+        for files in sources:
+            if isinstance(files, list):
+                files.sort(key = naturalKey)
+        images = [f for files in sources if isinstance(files, list) for f in files]
+        if args["probe"] and len(images) != sum(len(files) for files in sources):
+            print("--probe only works on frame files, not archives or line stores")
+            sys.exit(1)
+        if dual and None in lines:
+            if len(images) != sum(len(files) for files in sources):
+                print("Archives and line stores need both lines with --field2")
+                sys.exit(1)
+            even, odd = detectImageLine(images, fields = True)
+            if lines == [None, None]:
+                # field 2 is the line after field 1
+                lines = sorted((even, odd)) if None not in (even, odd) else [None, None]
+            elif lines[0] is None:
+                lines[0] = even if lines[1] % 2 else odd
+            else:
+                lines[1] = odd if lines[0] % 2 == 0 else even
+            if None in lines:
+                print("Couldn't find the CC lines")
+                sys.exit(1)
+            print(f"Using CC lines {lines[0]} and {lines[1]}", file = sys.stderr)
+        elif lines[0] is None and images:
+            lines[0] = detectImageLine(images)
+            if lines[0] is None:
+                print("Couldn't find a CC line")
+                sys.exit(1)
+            print(f"Using CC line {lines[0]}", file = sys.stderr)
+        line = lines if dual else lines[0]
+        # skip the frame files that are done; anything after that has to
+        # be read to find out how many frames it has
+        for i, files in enumerate(sources):
+            if not isinstance(files, list) or not skip:
+                break
+            done = min(skip, len(files))
+            sources[i] = files[done:]
+            skip -= done
+        if args["probe"] and args["executor"] == "process":
+            # one pool for all of the windows that iterAdaptiveByteStream
+            # decodes, rather than starting one for each
+            pool = Pool(args["threads"])
+        if cache:
+            decodeFiles = partial(iterCachedByteStream, line = line, cache = cache,
+                                  threads = args["threads"], DEBUG = args["debug"],
+                                  chunksize = args["chunksize"], lock = args["lock_geometry"],
+                                  stats = stats, executor = args["executor"],
+                                  vote = args["vote"], subpixel = args["subpixel"],
+                                  tiered = args["tiered"], details = details, status = True,
+                                  pool = pool)
+        else:
+            decodeFiles = partial(iterByteStream, line = line,
+                                  threads = args["threads"], DEBUG = args["debug"],
+                                  chunksize = args["chunksize"], lock = args["lock_geometry"],
+                                  stats = stats, executor = args["executor"],
+                                  vote = args["vote"], subpixel = args["subpixel"],
+                                  tiered = args["tiered"], details = details, status = True,
+                                  pool = pool)
+        if args["probe"]:
+            decodeFiles = partial(iterAdaptiveByteStream, decode = decodeFiles,
+                                  lines = len(lines), probe = args["probe"],
+                                  gap = args["probe_gap"], stats = stats, details = details,
+                                  status = True)
+        stream = chain.from_iterable(
+            decodeFiles(files)
+            if isinstance(files, list) else
+            iterLineStoreByteStream(files, line, args["debug"],
+                                    args["lock_geometry"], stats, args["executor"],
+                                    args["threads"], args["vote"], args["subpixel"],
+                                    args["tiered"], details, status = True)
+            if isLineStore(files) else
+            iterArchiveByteStream(files, line, args["debug"],
+                                  args["lock_geometry"], stats, args["executor"],
+                                  args["threads"], args["vote"], args["subpixel"],
+                                  args["tiered"], details, status = True)
+            for files in sources if files)
+
+    # the stream has the status (or the details) of every line until here
+    sidecar = None
+    if details:
+        # numbered from the first frame that's decoded
+        sidecar = SidecarWriter(args["sidecar"], len(lines), resumed - skip)
+        stream = sidecarStream(stream, sidecar)
+    stream = failureStream(stream, args["report_interval"])
+    if skip:
+        stream = skipFrames(stream, skip * len(lines))
+    if args["checkpoint"]:
+        stream = checkpointStream(stream, args["checkpoint"], args["checkpoint_interval"],
+                                  checkpoint["data"] if checkpoint else b"",
+                                  {"sources": args["file-or-dir"], "video": args["video"],
+                                   "line": line})
+    if stats:
+        stream = statsStream(stream, stats, args["stats"], args["stats_interval"])
+
+    writers = []
+    if args["framerate"] is None:
+        args["framerate"] = 29.97
+    if args["vtt"]:
+        writers.append(SubtitleWriter(args["vtt"], "vtt", args["framerate"]))
+    if args["srt"]:
+        writers.append(SubtitleWriter(args["srt"], "srt", args["framerate"]))
+    if writers:
+        stream = captionStream(stream, writers, args["channel"], len(lines))
+
+    outputs = [args["output"], args["field2_output"]] if dual else [args["output"]]
+    try:
+        if args["raw"]:
+            writeByteStream(stream, [o.buffer for o in outputs], raw = True)
+        else:
+            writeByteStream(stream, outputs)
+    except (OSError, RuntimeError, ValueError, sqlite3.Error) as e:
+        print(e)
+        sys.exit(1)
+    finally:
+        if sidecar:
+            sidecar.close()
+    if cache:
+        cache.close()
+    if pool:
+        pool.terminate()
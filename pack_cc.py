@@ -0,0 +1,114 @@
+#!/usr/bin/env python3.6
+#
+# Copyright 2016-2018 Trustees of Indiana University
+#
+# This code is licensed under the APACHE 2.0 License
+#
+
+"""
+Pack the CC band of every frame of a capture into a line store (see
+writeLineStore in decode_cc), so decode_cc.py can decode it again with
+one sequential read rather than opening every frame image.
+"""
+
+from decode_cc import (writeLineStore, readImageBands, readArchiveBands, readVideoFrames,
+                       listFrames, naturalKey, isArchive)
+from itertools import chain
+import argparse
+import sys
+import os
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Pack the CC band of each frame into a line store for decode_cc.py")
+    parser.add_argument("--framerate",
+                        default = 29.97,
+                        type = float,
+                        help = "Frame rate of the capture (default 29.97)")
+    parser.add_argument("--glob",
+                        action = "append",
+                        help = "Only use the files in the directories that match this pattern, like '*.png' (can be given more than once)")
+    parser.add_argument("--recursive",
+                        action = "store_true",
+                        default = False,
+                        help = "Also use the files in subdirectories")
+    parser.add_argument("--video",
+                        action = "store_true",
+                        default = False,
+                        help = "The files are videos to read through ffmpeg")
+    parser.add_argument("--ffmpeg",
+                        default = "ffmpeg",
+                        help = "The ffmpeg binary to use with --video")
+    parser.add_argument("--ccbase",
+                        type = int,
+                        help = "First line to keep (default 25 with --video, otherwise every row of frames up to --ccheight high)")
+    parser.add_argument("--ccheight",
+                        default = 4,
+                        type = int,
+                        help = "Number of lines to keep (default 4)")
+    parser.add_argument("output",
+                        help = "The line store to write")
+    parser.add_argument("file-or-dir",
+                        nargs = '+',
+                        help = "Frame image files, directories or archives (or videos with --video)")
+    args = vars(parser.parse_args())
+
+    if args["video"]:
+        for f in args["file-or-dir"]:
+            if not os.path.isfile(f):
+                print(f"Not a file: {f}")
+                sys.exit(1)
+        ccbase = 25 if args["ccbase"] is None else args["ccbase"]
+        bands = chain.from_iterable(readVideoFrames(f, ccbase, args["ccheight"], args["ffmpeg"])
+                                    for f in args["file-or-dir"])
+    else:
+        # archives, and lists of the frame files between them, the same
+        # as decode_cc.py
+        sources = []
+        for f in args["file-or-dir"]:
+            if os.path.isfile(f) and isArchive(f):
+                sources.append(f)
+                continue
+            if not sources or not isinstance(sources[-1], list):
+                sources.append([])
+            if os.path.isfile(f):
+                sources[-1].append(f)
+            elif os.path.isdir(f):
+                sources[-1].extend(listFrames(f, args["glob"], args["recursive"]))
+            else:
+                print(f"Not a file or directory: {f}")
+                sys.exit(1)
+        for files in sources:
+            if isinstance(files, list):
+                files.sort(key = naturalKey)
+        rows = None
+        if args["ccbase"] is not None:
+            rows = range(args["ccbase"], args["ccbase"] + args["ccheight"])
+        bands = chain.from_iterable(readImageBands(files, rows = rows)
+                                    if isinstance(files, list) else
+                                    readArchiveBands(files, rows = rows)
+                                    for files in sources)
+        if rows is None:
+            # frames that are more than the CC band would make a store as
+            # big as the frames themselves
+            try:
+                first = next(bands, None)
+            except (OSError, RuntimeError, ValueError) as e:
+                print(e)
+                sys.exit(1)
+            if first is not None and first.shape[1] > args["ccheight"]:
+                print(f"The frames are {first.shape[1]} rows high; use --ccbase (and "
+                      f"--ccheight) to pick out the CC band")
+                sys.exit(1)
+            bands = chain([first] if first is not None else [], bands)
+
+    try:
+        count = writeLineStore(args["output"], bands, args["framerate"])
+    except (OSError, RuntimeError, ValueError) as e:
+        print(e)
+        sys.exit(1)
+    print(f"Packed {count} frames into {args['output']}", file = sys.stderr)
+
+
+if __name__ == "__main__":
+    main()